@@ -0,0 +1,220 @@
+"""Run the precipitation climatology for many configuration files in parallel."""
+
+import argparse
+import json
+import os
+import sys
+import time
+import traceback
+from pathlib import Path
+
+from precipitation_climatology import run_configuration
+from render_pool import create_render_pool
+
+# Configuration settings holding paths, which are resolved relative to the
+# configuration file rather than the directory a configuration is run in. Other
+# outputs, such as the figures and country tables, go in the run directory.
+CONFIG_PATH_KEYS = (
+    "input_file",
+    "natural_earth_directory",
+    "cache_directory",
+    "incremental_state_file",
+    "reductions_store",
+)
+
+
+def _absolute_config_paths(paths, config_directory):
+    """
+    Resolve paths in a configuration relative to the configuration file.
+
+    Parameters
+    ----------
+    paths : str or list(str) or None
+        path, glob pattern, or list of these from a configuration
+    config_directory : pathlib.Path
+        directory containing the configuration file
+
+    Returns
+    -------
+    paths : str or list(str) or None
+        the paths as absolute paths, or None if `paths` is None
+
+    """
+    if paths is None:
+        return None
+    if isinstance(paths, str):
+        return str((config_directory / Path(paths).expanduser()).resolve())
+    return [
+        str((config_directory / Path(path).expanduser()).resolve()) for path in paths
+    ]
+
+
+def run_single_configuration(config_file, output_directory):
+    """
+    Run the program for a single configuration file in its own output directory.
+
+    Relative paths of the settings in CONFIG_PATH_KEYS, such as the input files and
+    cache directory, are taken relative to the configuration file. Failures
+    are caught and recorded rather than raised, so that one bad configuration does
+    not stop the rest of a batch.
+
+    Parameters
+    ----------
+    config_file : str
+        path to the JSON configuration file
+    output_directory : str
+        directory in which a sub-directory is created for this configuration's outputs
+
+    Returns
+    -------
+    result : dict
+        summary of the run with keys "config_file", "output_directory", "status"
+        ("success" or "failed"), "elapsed_seconds" and "error".
+
+    """
+    config_path = Path(config_file).resolve()
+    config_name = config_path.stem
+    run_directory = Path(output_directory).resolve() / config_name
+
+    result = {
+        "config_file": str(config_path),
+        "output_directory": str(run_directory),
+        "status": "success",
+        "elapsed_seconds": None,
+        "error": None,
+    }
+
+    start_time = time.perf_counter()
+    original_directory = Path.cwd()
+    try:
+        with open(config_path, encoding="utf-8") as json_file:
+            config = json.load(json_file)
+        for config_key in CONFIG_PATH_KEYS:
+            if config_key in config:
+                config[config_key] = _absolute_config_paths(
+                    config[config_key], config_path.parent
+                )
+
+        run_directory.mkdir(parents=True, exist_ok=True)
+        # Each worker runs one configuration at a time, so changing directory keeps
+        # the diagnostic outputs of different configurations apart.
+        os.chdir(run_directory)
+        run_configuration(config, output_file=f"{config_name}_output.png")
+    except Exception:  # noqa: BLE001
+        result["status"] = "failed"
+        result["error"] = traceback.format_exc()
+    finally:
+        os.chdir(original_directory)
+        # Reset matplotlib so that no figures or style changes leak between runs.
+        # It is only loaded by runs drawing figures, so there is nothing to reset
+        # otherwise.
+        if "matplotlib.pyplot" in sys.modules:
+            sys.modules["matplotlib.pyplot"].close("all")
+            sys.modules["matplotlib"].rcdefaults()
+        result["elapsed_seconds"] = time.perf_counter() - start_time
+
+    return result
+
+
+def run_batch(
+    config_files,
+    output_directory="batch_output",
+    max_workers=None,
+    summary_file="batch_summary.json",
+):
+    """
+    Run the program for many configuration files over a pool of processes.
+
+    Parameters
+    ----------
+    config_files : list(str)
+        paths to the JSON configuration files to run
+    output_directory : optional str
+        directory to write outputs to, one sub-directory per configuration
+    max_workers : optional int
+        number of worker processes. Defaults to the number of available CPUs.
+    summary_file : optional str
+        filename, within `output_directory`, to write the JSON run summary to
+
+    Returns
+    -------
+    results : list(dict)
+        summary of each run, in the order of `config_files`, as returned by
+        run_single_configuration.
+
+    """
+    if max_workers is None:
+        # CPUs available to this process, where the platform can tell (Linux).
+        if hasattr(os, "sched_getaffinity"):
+            max_workers = len(os.sched_getaffinity(0))
+        else:
+            max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, len(config_files)))
+
+    Path(output_directory).mkdir(parents=True, exist_ok=True)
+
+    batch_start_time = time.perf_counter()
+    with create_render_pool(max_workers) as executor:
+        results = list(
+            executor.map(
+                run_single_configuration,
+                config_files,
+                [output_directory] * len(config_files),
+            )
+        )
+    batch_elapsed_seconds = time.perf_counter() - batch_start_time
+
+    failed_runs = [result for result in results if result["status"] == "failed"]
+    summary = {
+        "total_configs": len(results),
+        "succeeded": len(results) - len(failed_runs),
+        "failed": len(failed_runs),
+        "max_workers": max_workers,
+        "elapsed_seconds": batch_elapsed_seconds,
+        "runs": results,
+    }
+    with open(
+        Path(output_directory) / summary_file, "w", encoding="utf-8"
+    ) as json_file:
+        json.dump(summary, json_file, indent=2)
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run the precipitation climatology for many configuration files."
+    )
+    parser.add_argument("config_files", nargs="+", help="JSON configuration files")
+    parser.add_argument(
+        "--output-dir",
+        default="batch_output",
+        help="directory to write outputs to (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="number of worker processes (default: number of available CPUs)",
+    )
+    parser.add_argument(
+        "--summary",
+        default="batch_summary.json",
+        help="summary filename within the output directory (default: %(default)s)",
+    )
+    args = parser.parse_args()
+
+    batch_results = run_batch(
+        args.config_files,
+        output_directory=args.output_dir,
+        max_workers=args.workers,
+        summary_file=args.summary,
+    )
+
+    for batch_result in batch_results:
+        print(
+            f"{batch_result['status'].ljust(8)} "
+            f"{batch_result['elapsed_seconds']:8.2f} s  {batch_result['config_file']}"
+        )
+    if any(batch_result["status"] == "failed" for batch_result in batch_results):
+        raise SystemExit(1)
@@ -0,0 +1,93 @@
+"""Benchmark the start-up (import) time of precipitation_climatology.
+
+Each import is timed in a fresh Python process. The benchmark fails if the median
+import time exceeds a threshold, or if any of the slow plotting or geographic
+libraries are imported at start-up rather than when the diagnostic needing them
+runs.
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+CODE_DIRECTORY = Path(__file__).resolve().parent.parent
+DEFERRED_MODULES = ["cartopy", "cmocean", "matplotlib", "regionmask", "dask"]
+
+IMPORT_SCRIPT = f"""
+import json, sys, time
+start_time = time.perf_counter()
+import precipitation_climatology
+import_seconds = time.perf_counter() - start_time
+loaded_modules = [name for name in {DEFERRED_MODULES!r} if name in sys.modules]
+print(json.dumps({{"import_seconds": import_seconds, "loaded": loaded_modules}}))
+"""
+
+
+def time_import():
+    """
+    Time importing precipitation_climatology in a fresh Python process.
+
+    Returns
+    -------
+    import_seconds : float
+        wall time taken by the import statement
+    loaded_modules : list(str)
+        deferred modules that were nevertheless loaded by the import
+
+    """
+    completed_process = subprocess.run(  # noqa: S603
+        [sys.executable, "-c", IMPORT_SCRIPT],
+        cwd=CODE_DIRECTORY,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    result = json.loads(completed_process.stdout.strip().splitlines()[-1])
+    return result["import_seconds"], result["loaded"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=5,
+        help="number of fresh processes to time (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--max-seconds",
+        type=float,
+        default=1.0,
+        help="fail if the median import time exceeds this (default: %(default)s)",
+    )
+    args = parser.parse_args()
+
+    import_times = []
+    loaded_modules = set()
+    for _ in range(args.repeats):
+        import_seconds, loaded = time_import()
+        import_times.append(import_seconds)
+        loaded_modules.update(loaded)
+
+    median_seconds = statistics.median(import_times)
+    print(f"median import time: {median_seconds:.3f} s over {args.repeats} runs")
+    print(f"min / max: {min(import_times):.3f} s / {max(import_times):.3f} s")
+
+    failures = []
+    if median_seconds > args.max_seconds:
+        failures.append(
+            f"median import time {median_seconds:.3f} s exceeds {args.max_seconds} s"
+        )
+    if loaded_modules:
+        failures.append(
+            f"modules loaded at import instead of on use: {sorted(loaded_modules)}"
+        )
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        raise SystemExit(1)
+    print("PASS")
@@ -0,0 +1,327 @@
+"""Benchmark how the stages of precipitation_climatology scale with data size.
+
+Synthetic CMIP-like datasets (see synthetic_data.py) are created at several grid
+resolutions and run lengths, so no input files are needed. The country and map
+benchmarks need Natural Earth data, which is downloaded on first use unless a
+local copy is given with --natural-earth-dir.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import matplotlib as mpl
+import numpy as np
+from synthetic_data import create_synthetic_precipitation
+
+CODE_DIRECTORY = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(CODE_DIRECTORY))
+
+import precipitation_climatology  # noqa: E402
+from climatology_cache import use_local_natural_earth  # noqa: E402
+
+BENCHMARKS = (
+    "convert",
+    "seasonal",
+    "countries_cold",
+    "countries_warm",
+    "plot_zonal",
+    "plot_hovmoller",
+    "plot_map",
+)
+
+
+def time_call(function, repeats=3):
+    """
+    Time a function call, taking the fastest of several repeats.
+
+    Parameters
+    ----------
+    function : callable
+        function taking no arguments to time
+    repeats : optional int
+        number of times to call the function
+
+    Returns
+    -------
+    seconds : float
+        shortest wall time of the calls
+
+    """
+    call_seconds = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        function()
+        call_seconds.append(time.perf_counter() - start_time)
+    return min(call_seconds)
+
+
+def benchmark_dataset(precipitation_data, benchmarks, countries, repeats=3):
+    """
+    Time the selected benchmarks on one dataset.
+
+    Run from a scratch directory, as the country table and figures are written to
+    the working directory.
+
+    Parameters
+    ----------
+    precipitation_data : xarray.Dataset
+        precipitation dataset as created by create_synthetic_precipitation
+    benchmarks : iterable(str)
+        names of the benchmarks to run, from BENCHMARKS
+    countries : dict(str: str)
+        countries to calculate annual averages for
+    repeats : optional int
+        number of repeats to take the fastest of
+
+    Returns
+    -------
+    benchmark_seconds : dict(str: float)
+        wall time of each benchmark
+
+    """
+    reductions = precipitation_climatology.calculate_precipitation_reductions(
+        precipitation_data
+    )
+    benchmark_functions = {
+        "convert": lambda: precipitation_climatology.convert_precipitation_units(
+            precipitation_data["pr"]
+        ),
+        "seasonal": lambda: (
+            precipitation_climatology.calculate_precipitation_reductions(
+                precipitation_data, reductions=["seasonal"]
+            )
+        ),
+    }
+
+    cache_directory = Path(tempfile.mkdtemp(dir="."))
+
+    def get_country_annual_average_cold():
+        # Start from an empty cache, so the country weights are calculated.
+        return precipitation_climatology.get_country_annual_average(
+            reductions["annual"],
+            countries,
+            cache_directory=tempfile.mkdtemp(dir=cache_directory),
+        )
+
+    benchmark_functions["countries_cold"] = get_country_annual_average_cold
+    benchmark_functions["countries_warm"] = lambda: (
+        precipitation_climatology.get_country_annual_average(
+            reductions["annual"], countries, cache_directory=cache_directory
+        )
+    )
+
+    if any(benchmark.startswith("plot_") for benchmark in benchmarks):
+        # Plotting libraries are slow to import, so only load them when drawing.
+        import climatology_plots  # noqa: PLC0415
+
+        reductions_mm_per_day = {
+            name: precipitation_climatology.convert_to_mm_per_day(reductions[name])
+            for name in ("zonal", "equatorial", "seasonal")
+        }
+        benchmark_functions["plot_zonal"] = lambda: climatology_plots.render_figure(
+            climatology_plots.plot_zonally_averaged_precipitation,
+            reductions_mm_per_day["zonal"],
+        )
+        benchmark_functions["plot_hovmoller"] = lambda: climatology_plots.render_figure(
+            climatology_plots.plot_enso_hovmoller_diagram,
+            reductions_mm_per_day["equatorial"].rename(equatorial_lon="lon"),
+        )
+        benchmark_functions["plot_map"] = lambda: climatology_plots.render_figure(
+            climatology_plots.save_precipitation_climatology_plot,
+            reductions_mm_per_day["seasonal"],
+            precipitation_data.attrs["source_id"],
+            "DJF",
+            "benchmark_map.png",
+        )
+
+    return {
+        benchmark: time_call(benchmark_functions[benchmark], repeats=repeats)
+        for benchmark in benchmarks
+    }
+
+
+def fit_scaling_exponent(n_values, seconds):
+    """
+    Fit the exponent of a power law, seconds ~ n_values**exponent.
+
+    Parameters
+    ----------
+    n_values : list(int)
+        number of data values in each dataset
+    seconds : list(float)
+        wall time taken on each dataset
+
+    Returns
+    -------
+    exponent : float or None
+        fitted exponent, about 1 for linear scaling, or None if there are fewer
+        than two dataset sizes
+
+    """
+    if len(set(n_values)) < 2:
+        return None
+    return float(np.polyfit(np.log(n_values), np.log(seconds), 1)[0])
+
+
+def plot_scaling_curves(results, output_file):
+    """
+    Plot the wall time of each benchmark against dataset size on log-log axes.
+
+    Each resolution is drawn as a separate line, showing how each benchmark scales
+    with the length of the run at a fixed grid.
+
+    Parameters
+    ----------
+    results : list(dict)
+        benchmark results as written by this script
+    output_file : str
+        filename to save the figure to
+
+    Returns
+    -------
+    None
+
+    """
+    import matplotlib.pyplot as plt  # noqa: PLC0415
+
+    figure, axes = plt.subplots(figsize=(10, 6), layout="constrained")
+    benchmarks = list(dict.fromkeys(result["benchmark"] for result in results))
+    grid_spacings = list(dict.fromkeys(result["grid_spacing"] for result in results))
+    # One colour per benchmark and one line style per resolution.
+    line_styles = ["-", "--", ":", "-."]
+    for benchmark_number, benchmark in enumerate(benchmarks):
+        for spacing_number, grid_spacing in enumerate(grid_spacings):
+            benchmark_results = sorted(
+                (result["n_values"], result["seconds"])
+                for result in results
+                if result["benchmark"] == benchmark
+                and result["grid_spacing"] == grid_spacing
+            )
+            axes.loglog(
+                *zip(*benchmark_results, strict=True),
+                color=f"C{benchmark_number}",
+                linestyle=line_styles[spacing_number % len(line_styles)],
+                marker="o",
+                label=f"{benchmark} ({grid_spacing} deg)",
+            )
+    axes.set_xlabel("number of data values (time x lat x lon)")
+    axes.set_ylabel("wall time [s]")
+    axes.grid(which="both", alpha=0.3)
+    figure.legend(loc="outside right upper", fontsize="small")
+    figure.savefig(output_file, dpi=150)
+    plt.close(figure)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--resolutions",
+        nargs="+",
+        type=float,
+        default=[2.5, 1.25],
+        help="grid spacings in degrees (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--years",
+        nargs="+",
+        type=int,
+        default=[5, 20, 50],
+        help="run lengths in years of monthly data (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--benchmarks",
+        nargs="+",
+        choices=BENCHMARKS,
+        default=list(BENCHMARKS),
+        metavar="BENCHMARK",
+        help=f"benchmarks to run, from {', '.join(BENCHMARKS)} (default: all)",
+    )
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=3,
+        help="repeats of each benchmark to take the fastest of (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--natural-earth-dir",
+        help="local Natural Earth data to use instead of downloading it",
+    )
+    parser.add_argument(
+        "--output",
+        default="scaling_results.json",
+        help="JSON file to write the results to (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--plot", help="filename to save a figure of the scaling curves to"
+    )
+    args = parser.parse_args()
+
+    mpl.use("Agg")
+    if args.natural_earth_dir is not None:
+        use_local_natural_earth(args.natural_earth_dir)
+    with open(CODE_DIRECTORY / "default_config.json", encoding="utf-8") as json_file:
+        countries_to_record = json.load(json_file)["countries_to_record"]
+
+    output_file = Path(args.output).resolve()
+    plot_file = Path(args.plot).resolve() if args.plot else None
+
+    results = []
+    with tempfile.TemporaryDirectory() as scratch_directory:
+        os.chdir(scratch_directory)
+        for grid_spacing in args.resolutions:
+            for n_years in args.years:
+                precipitation_data = create_synthetic_precipitation(
+                    grid_spacing=grid_spacing, n_years=n_years
+                )
+                n_values = precipitation_data["pr"].size
+                print(
+                    f"grid {grid_spacing} deg, {n_years} years "
+                    f"({dict(precipitation_data.sizes)}):"
+                )
+                benchmark_seconds = benchmark_dataset(
+                    precipitation_data,
+                    args.benchmarks,
+                    countries_to_record,
+                    repeats=args.repeats,
+                )
+                for benchmark, seconds in benchmark_seconds.items():
+                    print(f"  {benchmark:<16} {seconds:8.3f} s")
+                    results.append(
+                        {
+                            "benchmark": benchmark,
+                            "grid_spacing": grid_spacing,
+                            "n_years": n_years,
+                            **dict(precipitation_data.sizes),
+                            "n_values": n_values,
+                            "seconds": seconds,
+                        }
+                    )
+        # Leave the scratch directory so it can be removed.
+        os.chdir(output_file.parent)
+
+    print("Scaling exponents (seconds ~ n_values ** exponent):")
+    scaling_exponents = {}
+    for benchmark in args.benchmarks:
+        benchmark_results = [
+            result for result in results if result["benchmark"] == benchmark
+        ]
+        scaling_exponents[benchmark] = fit_scaling_exponent(
+            [result["n_values"] for result in benchmark_results],
+            [result["seconds"] for result in benchmark_results],
+        )
+        if scaling_exponents[benchmark] is not None:
+            print(f"  {benchmark:<16} {scaling_exponents[benchmark]:6.2f}")
+
+    with open(output_file, "w", encoding="utf-8") as json_file:
+        json.dump(
+            {"results": results, "scaling_exponents": scaling_exponents},
+            json_file,
+            indent=2,
+        )
+    if plot_file is not None:
+        plot_scaling_curves(results, plot_file)
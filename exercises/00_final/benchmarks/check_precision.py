@@ -0,0 +1,157 @@
+"""Check that single precision reductions match double precision in half the memory.
+
+The reductions of a synthetic float32 dataset (see synthetic_data.py) are calculated
+with each compute dtype of precipitation_climatology. Their largest relative
+difference and the peak memory allocated while calculating them are reported, and
+the script exits with an error if the difference exceeds the tolerance or single
+precision does not save memory.
+"""
+
+import argparse
+import sys
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+from synthetic_data import create_synthetic_precipitation
+
+CODE_DIRECTORY = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(CODE_DIRECTORY))
+
+import precipitation_climatology  # noqa: E402
+
+
+def measure_reductions(precipitation_data, compute_dtype):
+    """
+    Calculate all reductions of a dataset, tracing the memory allocated.
+
+    Parameters
+    ----------
+    precipitation_data : xarray.Dataset
+        precipitation dataset as created by create_synthetic_precipitation
+    compute_dtype : str
+        floating point type to reduce the data in. See
+        precipitation_climatology.calculate_precipitation_reductions.
+
+    Returns
+    -------
+    precipitation_reductions : xarray.Dataset
+        the reductions of `precipitation_data`
+    peak_traced_bytes : int
+        peak memory allocated while calculating the reductions, excluding the
+        input dataset
+
+    """
+    tracemalloc.start()
+    try:
+        precipitation_reductions = (
+            precipitation_climatology.calculate_precipitation_reductions(
+                precipitation_data, compute_dtype=compute_dtype
+            )
+        )
+        peak_traced_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return precipitation_reductions, peak_traced_bytes
+
+
+def calculate_relative_differences(reductions, reference_reductions):
+    """
+    Calculate the largest relative difference of each reduction from a reference.
+
+    Parameters
+    ----------
+    reductions : xarray.Dataset
+        reductions to check
+    reference_reductions : xarray.Dataset
+        reductions to compare against, with the same variables
+
+    Returns
+    -------
+    relative_differences : dict(str: float)
+        largest absolute difference of each variable, relative to the largest
+        absolute value of the reference
+
+    """
+    return {
+        variable: float(
+            np.nanmax(
+                np.abs(
+                    reductions[variable].values.astype("float64")
+                    - reference_reductions[variable].values
+                )
+            )
+            / np.nanmax(np.abs(reference_reductions[variable].values))
+        )
+        for variable in reference_reductions.data_vars
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--resolution",
+        type=float,
+        default=1.25,
+        help="grid spacing in degrees (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--years",
+        type=int,
+        default=50,
+        help="run length in years of monthly data (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1e-5,
+        help="largest relative difference allowed (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--max-memory-ratio",
+        type=float,
+        default=0.6,
+        help="largest ratio of float32 to float64 peak memory allowed "
+        "(default: %(default)s)",
+    )
+    args = parser.parse_args()
+
+    precipitation_data = create_synthetic_precipitation(
+        grid_spacing=args.resolution, n_years=args.years, dtype="float32"
+    )
+    print(
+        f"grid {args.resolution} deg, {args.years} years "
+        f"({dict(precipitation_data.sizes)}, "
+        f"{precipitation_data['pr'].nbytes / 1024**2:.1f} MiB of float32 input):"
+    )
+
+    reductions, peak_traced_bytes = {}, {}
+    for compute_dtype in precipitation_climatology.COMPUTE_DTYPES:
+        reductions[compute_dtype], peak_traced_bytes[compute_dtype] = (
+            measure_reductions(precipitation_data, compute_dtype)
+        )
+        print(
+            f"  {compute_dtype} peak memory "
+            f"{peak_traced_bytes[compute_dtype] / 1024**2:8.1f} MiB"
+        )
+
+    relative_differences = calculate_relative_differences(
+        reductions["float32"], reductions["float64"]
+    )
+    for variable, relative_difference in relative_differences.items():
+        print(f"  {variable:<15} largest relative difference {relative_difference:.2e}")
+    memory_ratio = peak_traced_bytes["float32"] / peak_traced_bytes["float64"]
+    print(f"  float32 / float64 peak memory {memory_ratio:.2f}")
+
+    failures = [
+        f"'{variable}' differs by {relative_difference:.2e} > {args.tolerance:.0e}"
+        for variable, relative_difference in relative_differences.items()
+        if relative_difference > args.tolerance
+    ]
+    if memory_ratio > args.max_memory_ratio:
+        failures.append(
+            f"peak memory ratio {memory_ratio:.2f} > {args.max_memory_ratio}"
+        )
+    if failures:
+        sys.exit("Precision check failed: " + "; ".join(failures))
+    print("Precision check passed.")
@@ -0,0 +1,107 @@
+"""Check that out of bounds precipitation is reported for in-memory and dask data.
+
+Values outside the allowed range are planted in a synthetic dataset (see
+synthetic_data.py), which is converted to mm/day both in memory and chunked with
+dask. Each conversion should raise a ValueError giving the location and value of
+every planted value, and the script exits with an error if any does not.
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+from synthetic_data import create_synthetic_precipitation
+
+CODE_DIRECTORY = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(CODE_DIRECTORY))
+
+import precipitation_climatology  # noqa: E402
+
+# Positions along ("time", "lat", "lon") and values in kg m-2 s-1 to plant, one
+# negative and one above the upper bound.
+PLANTED_VALUES = {(3, 10, 20): -1e-5, (5, 1, 2): 1.0}
+
+
+def get_conversion_error(precipitation):
+    """
+    Convert precipitation to mm/day, returning the message of the error raised.
+
+    Parameters
+    ----------
+    precipitation : xarray.DataArray
+        precipitation in kg m-2 s-1
+
+    Returns
+    -------
+    error_message : str or None
+        message of the ValueError raised by the conversion, or None if the data
+        was converted without one
+
+    """
+    try:
+        precipitation_climatology.convert_precipitation_units(precipitation)
+    except ValueError as error:
+        return str(error)
+    return None
+
+
+def find_missing_locations(precipitation, error_message):
+    """
+    Find the planted values not reported in an error message.
+
+    Parameters
+    ----------
+    precipitation : xarray.DataArray
+        precipitation the planted values are in
+    error_message : str
+        message of the error raised when converting `precipitation`
+
+    Returns
+    -------
+    missing_locations : list(dict)
+        coordinates of each planted value whose location is not in the message
+
+    """
+    missing_locations = []
+    for index in PLANTED_VALUES:
+        location = {
+            dim: str(precipitation[dim].values[position])
+            for dim, position in zip(precipitation.dims, index, strict=True)
+        }
+        if str(location)[1:-1] not in error_message:
+            missing_locations.append(location)
+    return missing_locations
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--chunk-months",
+        type=int,
+        default=12,
+        help="time steps in each dask chunk (default: %(default)s)",
+    )
+    args = parser.parse_args()
+
+    precipitation = create_synthetic_precipitation(grid_spacing=5, n_years=2)["pr"]
+    for index, value in PLANTED_VALUES.items():
+        precipitation[index] = value
+
+    failures = []
+    for backend, data in (
+        ("in-memory", precipitation),
+        ("dask", precipitation.chunk({"time": args.chunk_months})),
+    ):
+        error_message = get_conversion_error(data)
+        if error_message is None:
+            failures.append(f"{backend} data was converted without an error")
+            continue
+        print(f"  {backend:<10} {error_message}")
+        failures.extend(
+            f"{backend} error does not report {location}"
+            for location in find_missing_locations(precipitation, error_message)
+        )
+
+    if failures:
+        sys.exit("Validation check failed: " + "; ".join(failures))
+    print("Validation check passed.")
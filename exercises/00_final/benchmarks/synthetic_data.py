@@ -0,0 +1,90 @@
+"""Synthetic CMIP-like precipitation datasets for benchmarking without downloads."""
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+SECONDS_PER_DAY = 86400
+
+
+def create_synthetic_precipitation(
+    grid_spacing=2.5,
+    n_years=10,
+    source_id="SYNTHETIC-ESM",
+    seed=0,
+    dtype="float32",
+):
+    """
+    Create a synthetic monthly precipitation dataset laid out like CMIP6 Amon output.
+
+    The field has a seasonally migrating tropical rain belt, drier subtropics, a
+    zonal wave and random noise, so that reductions and plots do realistic work,
+    but it is not meant to be physically accurate.
+
+    Parameters
+    ----------
+    grid_spacing : optional float
+        spacing of the regular latitude-longitude grid in degrees
+    n_years : optional int
+        number of years of monthly data, starting in 1850
+    source_id : optional str
+        model name to store in the "source_id" attribute
+    seed : optional int
+        seed of the random noise, so datasets are reproducible
+    dtype : optional str
+        data type of the precipitation values
+
+    Returns
+    -------
+    precipitation_data : xarray.Dataset
+        Dataset containing "pr" in [kg m-2 s-1] with dimensions ("time", "lat",
+        "lon"), with CMIP-like variable and global attributes
+
+    """
+    latitude = np.arange(-90, 90 + grid_spacing / 2, grid_spacing)
+    longitude = np.arange(0, 360, grid_spacing)
+    # Mid-month time stamps, as in CMIP monthly means.
+    time = pd.date_range("1850-01-01", periods=12 * n_years, freq="MS") + pd.Timedelta(
+        days=14
+    )
+
+    random_generator = np.random.default_rng(seed)
+    month_angle = 2 * np.pi * (time.month.values - 1) / 12
+    rain_belt_latitude = 8 * np.sin(month_angle)[:, np.newaxis, np.newaxis]
+    latitude_grid = latitude[np.newaxis, :, np.newaxis]
+    longitude_grid = np.deg2rad(longitude)[np.newaxis, np.newaxis, :]
+
+    precipitation_mm_per_day = (
+        1.5
+        + 8 * np.exp(-(((latitude_grid - rain_belt_latitude) / 10) ** 2))
+        + 2 * np.exp(-(((np.abs(latitude_grid) - 50) / 12) ** 2))
+    ) * (1 + 0.3 * np.sin(2 * longitude_grid))
+    precipitation_mm_per_day = precipitation_mm_per_day * random_generator.gamma(
+        shape=4.0, scale=0.25, size=(time.size, latitude.size, longitude.size)
+    )
+
+    return xr.Dataset(
+        {
+            "pr": (
+                ("time", "lat", "lon"),
+                (precipitation_mm_per_day / SECONDS_PER_DAY).astype(dtype),
+                {
+                    "standard_name": "precipitation_flux",
+                    "long_name": "Precipitation",
+                    "units": "kg m-2 s-1",
+                },
+            )
+        },
+        coords={
+            "time": time,
+            "lat": ("lat", latitude, {"units": "degrees_north"}),
+            "lon": ("lon", longitude, {"units": "degrees_east"}),
+        },
+        attrs={
+            "source_id": source_id,
+            "experiment_id": "historical",
+            "variant_label": "r1i1p1f1",
+            "table_id": "Amon",
+            "frequency": "mon",
+        },
+    )
@@ -0,0 +1,327 @@
+"""On-disk caches for products that are expensive to recompute between runs."""
+
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import xarray as xr
+
+DEFAULT_CACHE_DIRECTORY = Path("~/.cache/precipitation_climatology").expanduser()
+MAX_MASK_CACHE_SIZE_MB = 200
+MAX_RESULT_CACHE_SIZE_MB = 1000
+
+
+def hash_grid(latitude, longitude):
+    """
+    Create a hash identifying a latitude-longitude grid.
+
+    Parameters
+    ----------
+    latitude : array_like
+        latitude coordinate values of the grid
+    longitude : array_like
+        longitude coordinate values of the grid
+
+    Returns
+    -------
+    grid_hash : str
+        hexadecimal digest of the grid coordinates
+
+    """
+    grid_hash = hashlib.sha256()
+    for coordinate in (latitude, longitude):
+        coordinate_values = np.ascontiguousarray(coordinate, dtype=np.float64)
+        grid_hash.update(str(coordinate_values.shape).encode())
+        grid_hash.update(coordinate_values.tobytes())
+    return grid_hash.hexdigest()
+
+
+def hash_input_files(input_files, **parameters):
+    """
+    Create a hash identifying a set of input files and the parameters used on them.
+
+    Files are identified by their absolute path, size and modification time, so a
+    file that is rewritten or extended gets a new hash without reading its contents.
+    Directory stores such as Zarr are identified by all the files within them.
+
+    Parameters
+    ----------
+    input_files : iterable(str or pathlib.Path)
+        input files or directory stores, in the order they are combined
+    **parameters
+        JSON serialisable parameters affecting the result calculated from the files
+
+    Returns
+    -------
+    input_hash : str
+        hexadecimal digest of the file identities and parameters
+
+    """
+    input_hash = hashlib.sha256()
+    for input_file in input_files:
+        input_path = Path(input_file).resolve()
+        # Directory stores (e.g. Zarr) are identified by every file they contain.
+        store_files = (
+            sorted(path for path in input_path.rglob("*") if path.is_file())
+            if input_path.is_dir()
+            else [input_path]
+        )
+        for store_file in store_files:
+            file_status = store_file.stat()
+            input_hash.update(
+                f"{store_file}:{file_status.st_size}:{file_status.st_mtime_ns}\n".encode()
+            )
+    input_hash.update(json.dumps(parameters, sort_keys=True).encode())
+    return input_hash.hexdigest()
+
+
+def evict_least_recently_used(cache_directory, max_size_bytes, pattern="*"):
+    """
+    Delete the least recently used files in a cache until it fits a size budget.
+
+    Parameters
+    ----------
+    cache_directory : pathlib.Path
+        directory containing the cached files
+    max_size_bytes : int
+        maximum total size of the matching files to keep
+    pattern : optional str
+        glob pattern selecting the files managed by this budget
+
+    Returns
+    -------
+    None
+
+    """
+    cached_files = []
+    for cached_file in cache_directory.glob(pattern):
+        try:
+            file_status = cached_file.stat()
+        except FileNotFoundError:
+            # Removed by another process since the glob.
+            continue
+        cached_files.append((file_status.st_mtime, file_status.st_size, cached_file))
+
+    total_size_bytes = sum(file_size for _, file_size, _ in cached_files)
+    for _, file_size, cached_file in sorted(cached_files):
+        if total_size_bytes <= max_size_bytes:
+            break
+        cached_file.unlink(missing_ok=True)
+        total_size_bytes -= file_size
+
+
+def write_cache_file(data, cache_file):
+    """
+    Write xarray data to a netCDF cache file atomically.
+
+    The data is written to a temporary file which is then renamed into place, so
+    concurrent runs never read a partially written file.
+
+    Parameters
+    ----------
+    data : xarray.DataArray or xarray.Dataset
+        data to write
+    cache_file : pathlib.Path
+        destination of the cached data
+
+    Returns
+    -------
+    None
+
+    """
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    file_descriptor, temporary_file = tempfile.mkstemp(
+        dir=cache_file.parent, suffix=".tmp"
+    )
+    os.close(file_descriptor)
+    try:
+        data.to_netcdf(temporary_file)
+        os.replace(temporary_file, cache_file)
+    finally:
+        Path(temporary_file).unlink(missing_ok=True)
+
+
+def get_cached_result(
+    cache_key,
+    calculate_result,
+    cache_directory=None,
+    max_cache_size_mb=MAX_RESULT_CACHE_SIZE_MB,
+    *,
+    subdirectory="results",
+    load_result=xr.load_dataset,
+):
+    """
+    Get a result from an on-disk cache, calculating it only if not cached.
+
+    Each kind of result (e.g. reductions, region masks, weights) is cached as
+    netCDF files in its own subdirectory of the cache directory, with its own size
+    budget.
+
+    Parameters
+    ----------
+    cache_key : str
+        key identifying the result, e.g. from hash_input_files or hash_grid
+    calculate_result : callable
+        function taking no arguments that calculates the result as an
+        xarray.Dataset or xarray.DataArray when it is not cached
+    cache_directory : optional str or pathlib.Path
+        directory to store cached results in. Defaults to DEFAULT_CACHE_DIRECTORY.
+    max_cache_size_mb : optional float
+        maximum total size of the cached results in `subdirectory`. The least
+        recently used results are removed once this is exceeded. If 0 the cache is
+        bypassed.
+    subdirectory : optional str
+        subdirectory of `cache_directory` holding this kind of result
+    load_result : optional callable
+        function reading a cached result from its file, e.g. xarray.load_dataarray
+        for DataArray results. Defaults to xarray.load_dataset.
+
+    Returns
+    -------
+    result : xarray.Dataset or xarray.DataArray
+        the cached or newly calculated result
+
+    """
+    if max_cache_size_mb == 0:
+        return calculate_result()
+
+    if cache_directory is None:
+        cache_directory = DEFAULT_CACHE_DIRECTORY
+    result_directory = Path(cache_directory) / subdirectory
+    cache_file = result_directory / f"{cache_key}.nc"
+
+    if cache_file.exists():
+        # Mark as recently used for eviction.
+        cache_file.touch()
+        return load_result(cache_file)
+
+    result = calculate_result()
+
+    write_cache_file(result, cache_file)
+    evict_least_recently_used(
+        result_directory, max_cache_size_mb * 1024**2, pattern="*.nc"
+    )
+
+    return result
+
+
+def get_region_mask(
+    latitude,
+    longitude,
+    region_set="countries_110",
+    cache_directory=None,
+    max_cache_size_mb=MAX_MASK_CACHE_SIZE_MB,
+):
+    """
+    Get a Natural Earth region mask for a grid, rasterising it only if not cached.
+
+    Masks are stored on disk keyed by the grid coordinates and region set, so repeat
+    runs on the same model grid skip both loading the region polygons and
+    rasterising them.
+
+    Parameters
+    ----------
+    latitude : xarray.DataArray
+        latitude coordinate of the grid
+    longitude : xarray.DataArray
+        longitude coordinate of the grid
+    region_set : optional str
+        name of the region set in regionmask.defined_regions.natural_earth_v5_0_0
+    cache_directory : optional str or pathlib.Path
+        directory to store cached masks in. Defaults to DEFAULT_CACHE_DIRECTORY.
+    max_cache_size_mb : optional float
+        maximum total size of cached masks. The least recently used masks are
+        removed once this is exceeded.
+
+    Returns
+    -------
+    region_mask : xarray.DataArray
+        mask of region numbers on the grid, NaN outside all regions. The attributes
+        "flag_values" and "flag_meanings" map region numbers to region codes.
+
+    """
+
+    def rasterise_region_mask():
+        # regionmask is slow to import, so only load it when a mask is rasterised.
+        import regionmask  # noqa: PLC0415
+
+        regions = getattr(regionmask.defined_regions.natural_earth_v5_0_0, region_set)
+        return regions.mask(xr.Dataset(coords={"lat": latitude, "lon": longitude}))
+
+    return get_cached_result(
+        f"natural_earth_v5_0_0.{region_set}_{hash_grid(latitude, longitude)}",
+        rasterise_region_mask,
+        cache_directory=cache_directory,
+        max_cache_size_mb=max_cache_size_mb,
+        subdirectory="region_masks",
+        load_result=xr.load_dataarray,
+    )
+
+
+def get_surface_mask(latitude, longitude, surface, cache_directory=None):
+    """
+    Get a mask of the land or ocean cells of a grid, rasterising it only if not cached.
+
+    Parameters
+    ----------
+    latitude : xarray.DataArray
+        latitude coordinate of the grid
+    longitude : xarray.DataArray
+        longitude coordinate of the grid
+    surface : str
+        surface to mask (one of "land" or "ocean")
+    cache_directory : optional str or pathlib.Path
+        directory to store cached masks in. See get_region_mask.
+
+    Returns
+    -------
+    surface_mask : xarray.DataArray
+        boolean mask on the grid, True for cells whose centre lies on `surface`
+
+    """
+    if surface not in {"land", "ocean"}:
+        raise ValueError(f"Mask must be one of 'land' or 'ocean', not '{surface}'")
+
+    land_mask = get_region_mask(
+        latitude, longitude, region_set="land_110", cache_directory=cache_directory
+    ).notnull()
+
+    return land_mask if surface == "land" else ~land_mask
+
+
+def use_local_natural_earth(natural_earth_directory):
+    """
+    Read Natural Earth data from a local directory instead of downloading it.
+
+    The directory is used by cartopy (for coastlines), which expects shapefiles
+    under "shapefiles/natural_earth/<category>/", and by regionmask (for country
+    and land masks), which expects its downloaded files under
+    "natural_earth/v5.0.0/". It is also exported as CARTOPY_DATA_DIR so that
+    worker processes started afterwards use it too.
+
+    Parameters
+    ----------
+    natural_earth_directory : str or pathlib.Path
+        directory containing the local copy of the Natural Earth data
+
+    Returns
+    -------
+    None
+
+    """
+    natural_earth_directory = Path(natural_earth_directory).expanduser().resolve()
+    if not natural_earth_directory.is_dir():
+        raise FileNotFoundError(
+            f"Natural Earth directory '{natural_earth_directory}' does not exist"
+        )
+
+    # Geographic libraries are slow to import, so only load them when needed.
+    import cartopy  # noqa: PLC0415
+    import regionmask  # noqa: PLC0415
+
+    os.environ["CARTOPY_DATA_DIR"] = str(natural_earth_directory)
+    cartopy.config["pre_existing_data_dir"] = natural_earth_directory
+    regionmask.set_options(cache_dir=natural_earth_directory)
@@ -0,0 +1,397 @@
+"""Plotting routines for precipitation climatology diagnostics.
+
+These are kept separate from the analysis so that the plotting libraries are only
+imported when a figure is actually drawn.
+"""
+
+import time
+
+import cartopy.crs as ccrs
+import cartopy.feature as cfeature
+import cmocean
+import matplotlib.colors as mcolors
+import matplotlib.pyplot as plt
+import matplotlib.ticker as mticker
+import numpy as np
+from cartopy.mpl.gridliner import LATITUDE_FORMATTER, LONGITUDE_FORMATTER
+from climatology_cache import get_surface_mask
+from render_pool import create_render_pool
+from run_profile import profile_stage, record_stage
+
+
+def plot_zonally_averaged_precipitation(zonal_precipitation):
+    """
+    Plot zonally-averaged precipitation data and save to file.
+
+    Parameters
+    ----------
+    zonal_precipitation : xarray.DataArray
+        Zonally-averaged precipitation in [mm day-1] at given latitudes and time.
+
+    Returns
+    -------
+    None
+
+    """
+    figure, axes = plt.subplots(nrows=4, ncols=1, figsize=(12, 8))
+
+    # Take the nearest grid latitudes, as these need not lie on the model grid.
+    for axis, latitudes in zip(
+        axes, ([0], [-20, 20], [-45, 45], [-70, 70]), strict=True
+    ):
+        zonal_precipitation.sel(lat=latitudes, method="nearest").plot.line(
+            ax=axis, hue="lat"
+        )
+
+    plt.tight_layout()
+    for axis in axes:
+        axis.set_ylim(0.0, 8.64)  # mm/day, equivalent to 1e-4 kg m-2 s-1
+        axis.grid()
+    plt.savefig("zonal.png", dpi=200)  # Save figure to file
+
+    figure, axes = plt.subplots(nrows=1, ncols=1, figsize=(12, 5))
+
+    zonal_precipitation.T.plot()
+
+    plt.savefig("zonal_map.png", dpi=200)  # Save figure to file
+
+
+def downsample_time(data, max_time_steps):
+    """
+    Average consecutive time steps together so the data has at most a given number.
+
+    Parameters
+    ----------
+    data : xarray.DataArray
+        data with a "time" dimension
+    max_time_steps : int
+        maximum number of time steps to keep
+
+    Returns
+    -------
+    downsampled_data : xarray.DataArray
+        means over blocks of equal numbers of consecutive time steps, or `data`
+        itself if it already has no more than `max_time_steps`. Each block is
+        labelled by the mean of its times; a final incomplete block is dropped.
+
+    """
+    time_steps_per_block = -(-data.sizes["time"] // max(max_time_steps, 1))
+    if time_steps_per_block <= 1:
+        return data
+
+    return data.coarsen(time=time_steps_per_block, boundary="trim").mean(
+        keep_attrs=True
+    )
+
+
+def plot_enso_hovmoller_diagram(equatorial_precipitation, dpi=200):
+    """
+    Plot Hovmöller diagram of equatorial precipitation to visualise ENSO.
+
+    If the series has more time steps than the plot has rows of pixels, consecutive
+    time steps are averaged together first, since they could not be told apart and
+    would only slow down drawing and bloat the figure.
+
+    Parameters
+    ----------
+    equatorial_precipitation : xarray.DataArray
+        Precipitation in [mm day-1] averaged over the equatorial latitude band, at
+        given longitudes and time.
+    dpi : optional float
+        resolution to save the figure at
+
+    Returns
+    -------
+    None
+
+    """
+    figure, axes = plt.subplots()
+    # Time runs along the vertical axis, so limit it to the height in pixels.
+    axes_height_pixels = axes.get_window_extent().height * dpi / figure.dpi
+
+    downsample_time(equatorial_precipitation, int(axes_height_pixels)).plot(ax=axes)
+    plt.savefig("enso.png", dpi=dpi)  # Save figure to file
+
+
+def add_climatology_map_features(geo_axes, surface_mask=None, plot_gridlines=False):
+    """
+    Add coastlines, an optional mask and optional gridlines to a climatology map.
+
+    Parameters
+    ----------
+    geo_axes : cartopy.mpl.geoaxes.GeoAxes
+        axes of the map
+    surface_mask : optional xarray.DataArray
+        boolean mask on the data grid of the cells to mask out (fade) on the map
+    plot_gridlines : bool
+        Select whether to plot gridlines
+
+    Returns
+    -------
+    None
+
+    """
+    geo_axes.add_feature(
+        cfeature.COASTLINE, lw=2
+    )  # Add coastines using cartopy feature
+
+    if surface_mask is not None:
+        # Fade the masked cells with a white raster on the data grid, which costs
+        # the same however detailed the coastline is.
+        surface_mask.where(surface_mask).plot.pcolormesh(
+            ax=geo_axes,
+            transform=ccrs.PlateCarree(),
+            cmap=mcolors.ListedColormap(["white"]),
+            alpha=0.75,
+            add_colorbar=False,
+            add_labels=False,
+        )
+
+    if plot_gridlines:
+        gridlines = geo_axes.gridlines(
+            crs=ccrs.PlateCarree(),
+            draw_labels=True,
+            linewidth=2,
+            color="gray",
+            alpha=0.5,
+            linestyle="--",
+        )
+        gridlines.top_labels = False
+        gridlines.left_labels = True
+        # gl.xlines = False
+        gridlines.xlocator = mticker.FixedLocator([-180, -90, 0, 90, 180])
+        gridlines.ylocator = mticker.FixedLocator(
+            [-66, -23, 0, 23, 66]
+        )  # Tropics & Polar Circles
+        gridlines.xformatter = LONGITUDE_FORMATTER
+        gridlines.yformatter = LATITUDE_FORMATTER
+        gridlines.xlabel_style = {"size": 15, "color": "gray"}
+        gridlines.ylabel_style = {"size": 15, "color": "gray"}
+
+
+def create_precipitation_climatology_plot(
+    seasonal_average_precipitation,
+    model_name,
+    season,
+    mask=None,
+    plot_gridlines=False,
+    levels=None,
+    cache_directory=None,
+):
+    """
+    Plot the precipitation climatology.
+
+    Parameters
+    ----------
+    seasonal_average_precipitation : xarray.DataArray
+        Precipitation climatology data. Seasonally averaged precipitation data.
+    model_name : str
+        Name of the climate model
+    season : str or list(str)
+        Climatological season (one of DJF, MAM, JJA, SON), or a list of seasons to
+        plot as a grid of panels in one figure sharing a projection, map features
+        and colorbar.
+    mask : optional str or xarray.DataArray
+        mask to apply to plot (one of "land" or "ocean"), or a boolean surface
+        mask on the data grid as returned by climatology_cache.get_surface_mask
+    plot_gridlines : bool
+
+        Select whether to plot gridlines
+    levels : list
+        Tick mark values for the colorbar
+    cache_directory : optional str
+        directory to cache the rasterised land/ocean mask in between runs
+
+    Returns
+    -------
+    None
+
+    """
+    if not levels:
+        levels = np.arange(0, 13.5, 1.5)
+
+    # Created once and shared by every panel, so the mask is only rasterised and
+    # the coastline geometry only projected once.
+    projection = ccrs.PlateCarree(central_longitude=180)
+    surface_mask = mask
+    if isinstance(mask, str):
+        # Mask out (fade) using the cached 110m resolution Natural Earth land mask.
+        surface_mask = get_surface_mask(
+            seasonal_average_precipitation.lat,
+            seasonal_average_precipitation.lon,
+            mask,
+            cache_directory=cache_directory,
+        )
+
+    if not isinstance(season, str):
+        ncols = 2
+        nrows = int(np.ceil(len(season) / ncols))
+        fig, geo_axes_grid = plt.subplots(
+            nrows=nrows,
+            ncols=ncols,
+            figsize=(18, 4.5 * nrows),
+            subplot_kw={"projection": projection},
+            layout="constrained",
+            squeeze=False,
+        )
+        for geo_axes, panel_season in zip(geo_axes_grid.flat, season, strict=False):
+            contours = seasonal_average_precipitation.sel(
+                season=panel_season
+            ).plot.contourf(
+                ax=geo_axes,
+                levels=levels,
+                extend="max",
+                transform=ccrs.PlateCarree(),
+                add_colorbar=False,
+                cmap=cmocean.cm.rain,
+            )
+            add_climatology_map_features(geo_axes, surface_mask, plot_gridlines)
+            geo_axes.set_title(panel_season)
+        for unused_axes in geo_axes_grid.flat[len(season) :]:
+            unused_axes.remove()
+
+        # One colorbar for all panels, as they share the same levels.
+        fig.colorbar(
+            contours,
+            ax=geo_axes_grid.flat[: len(season)].tolist(),
+            label=seasonal_average_precipitation.units,
+        )
+        fig.suptitle(f"{model_name} precipitation climatology")
+        return
+
+    fig, geo_axes = plt.subplots(
+        nrows=1,
+        ncols=1,
+        figsize=(12, 5),
+        subplot_kw={"projection": projection},
+    )
+
+    seasonal_average_precipitation.sel(season=season).plot.contourf(
+        ax=geo_axes,
+        levels=levels,
+        extend="max",
+        transform=ccrs.PlateCarree(),
+        cbar_kwargs={"label": seasonal_average_precipitation.units},
+        cmap=cmocean.cm.rain,
+    )
+
+    add_climatology_map_features(geo_axes, surface_mask, plot_gridlines)
+
+    title = f"{model_name} precipitation climatology ({season})"
+    plt.title(title)
+
+
+def save_precipitation_climatology_plot(
+    seasonal_average_precipitation,
+    model_name,
+    season,
+    output_file,
+    *,
+    mask=None,
+    plot_gridlines=False,
+    levels=None,
+):
+    """
+    Plot the precipitation climatology and save to file.
+
+    Parameters
+    ----------
+    seasonal_average_precipitation : xarray.DataArray
+        Precipitation climatology data. Seasonally averaged precipitation data.
+    model_name : str
+        Name of the climate model
+    season : str or list(str)
+        Climatological season (one of DJF, MAM, JJA, SON), or a list of seasons to
+        plot as panels of one figure
+    output_file : str
+        filename to save the image to
+    mask : optional str or xarray.DataArray
+        mask to apply to plot (one of "land" or "ocean"), or a boolean surface
+        mask on the data grid as returned by climatology_cache.get_surface_mask
+    plot_gridlines : bool
+        Select whether to plot gridlines
+    levels : list
+        Tick mark values for the colorbar
+
+    Returns
+    -------
+    None
+
+    """
+    create_precipitation_climatology_plot(
+        seasonal_average_precipitation,
+        model_name,
+        season,
+        mask=mask,
+        plot_gridlines=plot_gridlines,
+        levels=levels,
+    )
+    plt.savefig(output_file, dpi=200)
+
+
+def render_figure(plot_function, *args, **kwargs):
+    """
+    Call a plotting function with a clean pyplot state, closing its figures after.
+
+    Parameters
+    ----------
+    plot_function : callable
+        function that draws and saves one or more figures
+    *args
+        positional arguments to pass to `plot_function`
+    **kwargs
+        keyword arguments to pass to `plot_function`
+
+    Returns
+    -------
+    render_seconds : float
+        wall time taken to draw and save the figures
+
+    """
+    start_time = time.perf_counter()
+    plt.close("all")
+    try:
+        plot_function(*args, **kwargs)
+    finally:
+        plt.close("all")
+    return time.perf_counter() - start_time
+
+
+def render_figures(figure_tasks, render_workers=None):
+    """
+    Render a set of figures, optionally concurrently over a pool of processes.
+
+    The time taken by each figure is recorded as a stage of the active run profile,
+    if any, named after its plotting function. See run_profile.profile_stage.
+
+    Parameters
+    ----------
+    figure_tasks : list(tuple(callable, tuple, dict))
+        plotting function, positional arguments and keyword arguments for each
+        figure. The arguments should be small, reduced data as they are copied to
+        the worker processes.
+    render_workers : optional int
+        number of worker processes to render with. If None (default) the figures
+        are rendered one after another in this process.
+
+    Returns
+    -------
+    None
+
+    """
+    if render_workers is None:
+        for plot_function, args, kwargs in figure_tasks:
+            with profile_stage(plot_function.__name__):
+                render_figure(plot_function, *args, **kwargs)
+        return
+
+    with create_render_pool(max(1, min(render_workers, len(figure_tasks)))) as executor:
+        render_futures = [
+            executor.submit(render_figure, plot_function, *args, **kwargs)
+            for plot_function, args, kwargs in figure_tasks
+        ]
+        # Re-raise any error from rendering in this process.
+        for (plot_function, _, _), render_future in zip(
+            figure_tasks, render_futures, strict=True
+        ):
+            record_stage(plot_function.__name__, render_future.result())
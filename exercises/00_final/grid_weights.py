@@ -0,0 +1,410 @@
+"""Area and region weights for averaging gridded data over regions of the globe."""
+
+import warnings
+
+import numpy as np
+import scipy.sparse
+import xarray as xr
+from climatology_cache import get_cached_result, get_region_mask, hash_grid
+
+EARTH_RADIUS = 6.371e6  # m
+MAX_WEIGHTS_CACHE_SIZE_MB = 200
+
+
+def calculate_cell_bounds(coordinate_values):
+    """
+    Estimate the cell edges of a 1D grid coordinate from its cell centres.
+
+    Parameters
+    ----------
+    coordinate_values : numpy.ndarray
+        monotonic cell centre values of the coordinate
+
+    Returns
+    -------
+    cell_bounds : numpy.ndarray
+        cell edges, one longer than `coordinate_values`. Interior edges are midway
+        between centres and the outer edges are extrapolated by half a cell.
+
+    """
+    midpoints = 0.5 * (coordinate_values[1:] + coordinate_values[:-1])
+    first_bound = coordinate_values[0] - (midpoints[0] - coordinate_values[0])
+    last_bound = coordinate_values[-1] + (coordinate_values[-1] - midpoints[-1])
+    return np.concatenate([[first_bound], midpoints, [last_bound]])
+
+
+def calculate_cell_areas(latitude, longitude):
+    """
+    Calculate the surface area of each cell of a latitude-longitude grid.
+
+    Parameters
+    ----------
+    latitude : xarray.DataArray
+        latitude coordinate of the grid in degrees
+    longitude : xarray.DataArray
+        longitude coordinate of the grid in degrees
+
+    Returns
+    -------
+    cell_areas : xarray.DataArray
+        area of each grid cell in [m2] with dimensions ("lat", "lon")
+
+    """
+    latitude_bounds = np.clip(calculate_cell_bounds(latitude.values), -90.0, 90.0)
+    longitude_bounds = calculate_cell_bounds(longitude.values)
+
+    # Area between two latitudes is proportional to the difference in their sines.
+    latitude_band_heights = np.abs(np.diff(np.sin(np.deg2rad(latitude_bounds))))
+    longitude_widths = np.abs(np.diff(np.deg2rad(longitude_bounds)))
+
+    return xr.DataArray(
+        EARTH_RADIUS**2 * np.outer(latitude_band_heights, longitude_widths),
+        dims=("lat", "lon"),
+        coords={"lat": latitude.values, "lon": longitude.values},
+        attrs={"units": "m2", "long_name": "grid cell area"},
+    )
+
+
+def is_regular_grid(latitude, longitude):
+    """
+    Check whether a latitude-longitude grid is regularly spaced.
+
+    Parameters
+    ----------
+    latitude : xarray.DataArray
+        latitude coordinate of the grid
+    longitude : xarray.DataArray
+        longitude coordinate of the grid
+
+    Returns
+    -------
+    is_regular : bool
+        True if both coordinates are 1D with at least two equally spaced values.
+        Longitudes may wrap around once (e.g. from 180 to -180).
+
+    """
+    coordinate_steps = []
+    for coordinate in (latitude, longitude):
+        coordinate_values = np.asarray(coordinate)
+        if coordinate_values.ndim != 1 or coordinate_values.size < 2:
+            return False
+        coordinate_steps.append(np.diff(coordinate_values))
+    latitude_steps, longitude_steps = coordinate_steps
+    longitude_steps %= 360
+    return bool(
+        np.allclose(latitude_steps, latitude_steps[0])
+        and np.allclose(longitude_steps, longitude_steps[0])
+    )
+
+
+def find_region_cell_fractions(regions, grid, region_block_size=32):
+    """
+    Find the fraction of each grid cell lying within each region, as sparse entries.
+
+    Regions are rasterised a block at a time, so only the fractions of one block of
+    regions over the grid are held in memory, rather than those of every region.
+
+    Parameters
+    ----------
+    regions : regionmask.Regions
+        regions to find the cell fractions of
+    grid : xarray.Dataset
+        grid with regularly spaced "lat" and "lon" coordinates (see
+        is_regular_grid)
+    region_block_size : optional int
+        number of regions rasterised at a time
+
+    Returns
+    -------
+    region_numbers : numpy.ndarray
+        number of the region of each entry
+    cells : numpy.ndarray
+        index of the grid cell of each entry, in a flattened ("lat", "lon") array
+    fractions : numpy.ndarray
+        fraction of the cell lying within the region, for each entry. There are no
+        entries if no region covers the grid, e.g. a limited-area grid.
+
+    """
+    # Start from no entries, for grids no region covers.
+    region_entries = [(np.empty(0, dtype=int), np.empty(0, dtype=int), np.empty(0))]
+    for block_start in range(0, len(regions.numbers), region_block_size):
+        block_regions = regions[
+            list(regions.numbers[block_start : block_start + region_block_size])
+        ]
+        # Regions covering no cells are dropped, so entries keep the region numbers.
+        # Blocks of regions all off the grid are expected, so their warning is not
+        # passed on.
+        with warnings.catch_warnings():
+            warnings.filterwarnings(
+                "ignore", message="No gridpoint belongs to any region"
+            )
+            block_fractions = block_regions.mask_3D_frac_approx(grid, drop=True)
+        if block_fractions.sizes["region"] == 0:
+            continue
+        fraction_values = block_fractions.transpose(
+            "region", "lat", "lon"
+        ).values.reshape(block_fractions.sizes["region"], -1)
+        region_positions, cells = np.nonzero(fraction_values)
+        region_entries.append(
+            (
+                block_fractions.region.values[region_positions],
+                cells,
+                fraction_values[region_positions, cells],
+            )
+        )
+
+    return tuple(
+        np.concatenate(entries) for entries in zip(*region_entries, strict=True)
+    )
+
+
+def calculate_country_weights(
+    latitude,
+    longitude,
+    region_set="countries_110",
+    cache_directory=None,
+    region_block_size=32,
+):
+    """
+    Calculate a sparse matrix of area weights of each grid cell in each country.
+
+    Each weight is the area of a grid cell multiplied by the fraction of that cell
+    lying within the country. Fractional overlaps need a regularly spaced grid (see
+    is_regular_grid), including regional or limited-area ones; on other grids each
+    cell is assigned wholly to the country containing its centre.
+    The matrix is built from its nonzero entries, without a dense array of every
+    country over the grid.
+
+    Parameters
+    ----------
+    latitude : xarray.DataArray
+        latitude coordinate of the grid
+    longitude : xarray.DataArray
+        longitude coordinate of the grid
+    region_set : optional str
+        name of the region set in regionmask.defined_regions.natural_earth_v5_0_0
+    cache_directory : optional str or pathlib.Path
+        directory in which the region mask for irregular grids is cached. See
+        climatology_cache.get_region_mask.
+    region_block_size : optional int
+        number of countries rasterised at a time on regular grids. See
+        find_region_cell_fractions.
+
+    Returns
+    -------
+    country_weights : scipy.sparse.csr_array
+        weights with one row per country and one column per grid cell, with cells
+        ordered as in a flattened ("lat", "lon") array
+    region_codes : list(str)
+        region code (abbreviation) of the country in each row of `country_weights`
+
+    """
+    # regionmask is slow to import, so only load it when weights must be calculated.
+    import regionmask  # noqa: PLC0415
+
+    grid = xr.Dataset(coords={"lat": latitude, "lon": longitude})
+    regions = getattr(regionmask.defined_regions.natural_earth_v5_0_0, region_set)
+
+    if is_regular_grid(latitude, longitude):
+        region_numbers, cells, fractions = find_region_cell_fractions(
+            regions, grid, region_block_size=region_block_size
+        )
+    else:
+        # Fractional overlaps need a regular grid, so fall back to whole cells from
+        # the (cached) region mask.
+        country_mask = get_region_mask(
+            latitude,
+            longitude,
+            region_set=region_set,
+            cache_directory=cache_directory,
+        ).values.ravel()
+        cells = np.flatnonzero(np.isfinite(country_mask))
+        region_numbers = country_mask[cells]
+        fractions = np.ones(cells.size)
+
+    # Rows follow the order of the regions, whatever their numbers.
+    numbers = np.asarray(regions.numbers)
+    number_order = np.argsort(numbers)
+    rows = number_order[np.searchsorted(numbers, region_numbers, sorter=number_order)]
+
+    cell_areas = calculate_cell_areas(latitude, longitude).values.ravel()
+    country_weights = scipy.sparse.coo_array(
+        (fractions * cell_areas[cells], (rows, cells)),
+        shape=(numbers.size, cell_areas.size),
+    ).tocsr()
+
+    return country_weights, list(regions.abbrevs)
+
+
+def sparse_weights_to_dataset(weights):
+    """
+    Store a sparse weight matrix in a Dataset, so it can be saved as netCDF.
+
+    Parameters
+    ----------
+    weights : scipy.sparse.csr_array
+        sparse weight matrix
+
+    Returns
+    -------
+    weights_dataset : xarray.Dataset
+        Dataset of the compressed sparse row (CSR) arrays of the matrix, with its
+        shape in the "shape" attribute
+
+    """
+    return xr.Dataset(
+        {
+            "data": ("nonzero", weights.data),
+            "indices": ("nonzero", weights.indices),
+            "indptr": ("row_pointer", weights.indptr),
+        },
+        attrs={"shape": list(weights.shape)},
+    )
+
+
+def sparse_weights_from_dataset(weights_dataset):
+    """
+    Rebuild a sparse weight matrix stored by sparse_weights_to_dataset.
+
+    Parameters
+    ----------
+    weights_dataset : xarray.Dataset
+        Dataset of the compressed sparse row (CSR) arrays of the matrix
+
+    Returns
+    -------
+    weights : scipy.sparse.csr_array
+        sparse weight matrix
+
+    """
+    return scipy.sparse.csr_array(
+        (
+            weights_dataset["data"].values,
+            weights_dataset["indices"].values,
+            weights_dataset["indptr"].values,
+        ),
+        shape=tuple(weights_dataset.attrs["shape"]),
+    )
+
+
+def get_country_weights(
+    latitude,
+    longitude,
+    region_set="countries_110",
+    cache_directory=None,
+    max_cache_size_mb=MAX_WEIGHTS_CACHE_SIZE_MB,
+):
+    """
+    Get the sparse country weight matrix for a grid, calculating it only if not cached.
+
+    Parameters
+    ----------
+    latitude : xarray.DataArray
+        latitude coordinate of the grid
+    longitude : xarray.DataArray
+        longitude coordinate of the grid
+    region_set : optional str
+        name of the region set in regionmask.defined_regions.natural_earth_v5_0_0
+    cache_directory : optional str or pathlib.Path
+        directory to store cached weights in. Defaults to DEFAULT_CACHE_DIRECTORY.
+    max_cache_size_mb : optional float
+        maximum total size of cached weights. The least recently used weights are
+        removed once this is exceeded.
+
+    Returns
+    -------
+    country_weights : scipy.sparse.csr_array
+        weights with one row per country and one column per grid cell. See
+        calculate_country_weights.
+    region_codes : list(str)
+        region code (abbreviation) of the country in each row of `country_weights`
+
+    """
+
+    def calculate_weights_dataset():
+        country_weights, region_codes = calculate_country_weights(
+            latitude, longitude, region_set=region_set, cache_directory=cache_directory
+        )
+        return sparse_weights_to_dataset(country_weights).assign(
+            region_code=("region", region_codes)
+        )
+
+    weights_dataset = get_cached_result(
+        f"natural_earth_v5_0_0.{region_set}_{hash_grid(latitude, longitude)}",
+        calculate_weights_dataset,
+        cache_directory=cache_directory,
+        max_cache_size_mb=max_cache_size_mb,
+        subdirectory="region_weights",
+    )
+
+    return (
+        sparse_weights_from_dataset(weights_dataset),
+        weights_dataset["region_code"].values.tolist(),
+    )
+
+
+def apply_region_weights(region_weights, data, dtype="float64", block_size=16):
+    """
+    Calculate weighted averages of gridded data over regions.
+
+    Cells where the data is missing are left out and the remaining weights of each
+    region renormalised. Regions with no valid cells give NaN. Cells missing at
+    every step (e.g. masked land or ocean) are dropped from the weights once, so
+    the totals of the remaining weights come from the weight matrix, and only data
+    whose missing cells change between steps is masked value by value. Steps are
+    multiplied in blocks, so that only one block at a time is converted to double
+    precision.
+
+    Parameters
+    ----------
+    region_weights : scipy.sparse.csr_array
+        weights with one row per region and one column per grid cell, with cells
+        ordered as in a flattened ("lat", "lon") array
+    data : xarray.DataArray or numpy.ndarray
+        data to average, with "lat" and "lon" as its last two dimensions
+    dtype : optional str
+        floating point type of the averages. Sums are accumulated in double
+        precision either way.
+    block_size : optional int
+        number of leading (e.g. time) steps in each sparse matrix product
+
+    Returns
+    -------
+    region_averages : numpy.ndarray
+        weighted average of the data in each region, with the "lat" and "lon"
+        dimensions of `data` replaced by a trailing region dimension
+
+    """
+    leading_shape = data.shape[:-2]
+    data_values = np.asarray(data).reshape(-1, data.shape[-2] * data.shape[-1])
+
+    # Reduced over steps without any copy of the data: the sum of a cell is not
+    # finite if any of its values are missing, its fmax only NaN if all of them are.
+    partly_missing_cells = ~np.isfinite(data_values.sum(axis=0))
+    missing_cells = np.isnan(np.fmax.reduce(data_values, axis=0, initial=np.nan))
+    missing_cells_vary = not np.array_equal(partly_missing_cells, missing_cells)
+
+    valid_weights = region_weights
+    if not missing_cells_vary and missing_cells.any():
+        # Sparse products only read the stored weights, so dropping the weights of
+        # the missing cells leaves their values out without filling them.
+        valid_weights = region_weights.copy()
+        valid_weights.data[missing_cells[valid_weights.indices]] = 0
+        valid_weights.eliminate_zeros()
+    weight_totals = valid_weights.sum(axis=1)[:, np.newaxis]
+
+    region_averages = np.empty(
+        (data_values.shape[0], region_weights.shape[0]), dtype=dtype
+    )
+    for block_start in range(0, data_values.shape[0], block_size):
+        block = data_values[block_start : block_start + block_size]
+        if missing_cells_vary:
+            valid_cells = np.isfinite(block)
+            block = np.where(valid_cells, block, 0)
+            weight_totals = region_weights @ valid_cells.T.astype(block.dtype)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            region_averages[block_start : block_start + block_size] = (
+                valid_weights @ block.T / weight_totals
+            ).T
+
+    return region_averages.reshape(*leading_shape, region_weights.shape[0])
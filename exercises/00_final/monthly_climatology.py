@@ -0,0 +1,347 @@
+"""Monthly means of each year, from which annual and climatological means are derived."""
+
+import numpy as np
+import xarray as xr
+
+MONTHLY_CLIMATOLOGIES = ("annual", "seasonal", "monthly", "seasonal_series")
+# Months of each climatological season. December belongs to the DJF season of the
+# following season year, and the other seasons lie within a calendar year.
+SEASON_MONTHS = {
+    "DJF": (12, 1, 2),
+    "MAM": (3, 4, 5),
+    "JJA": (6, 7, 8),
+    "SON": (9, 10, 11),
+}
+
+
+def arrange_by_year_and_month(data, fill_value=0):
+    """
+    Arrange data along a dimension of year and month keys by year and by month.
+
+    The data is extended to whole years and its "year_month" dimension split in
+    two by reshaping, so data already covering whole years is not copied, and
+    data covering consecutive months is only padded at either end.
+
+    Parameters
+    ----------
+    data : xarray.DataArray
+        data with a "year_month" dimension whose unique coordinate values are
+        year * 12 + month - 1, in increasing order
+    fill_value : optional scalar
+        value to fill the months missing from `data` with
+
+    Returns
+    -------
+    arranged_data : xarray.DataArray
+        data with the "year_month" dimension replaced by "year" and "month"
+        dimensions, the months running from 1 to 12
+
+    """
+    year_month_keys = data.year_month.values
+    first_year, last_year = year_month_keys[0] // 12, year_month_keys[-1] // 12
+    months_before = year_month_keys[0] - first_year * 12
+    months_after = (last_year + 1) * 12 - 1 - year_month_keys[-1]
+    if year_month_keys[-1] - year_month_keys[0] + 1 != year_month_keys.size:
+        # Months are missing within the data.
+        whole_years = data.reindex(
+            year_month=np.arange(first_year * 12, (last_year + 1) * 12),
+            fill_value=fill_value,
+        )
+    elif months_before or months_after:
+        whole_years = data.pad(
+            year_month=(months_before, months_after), constant_values=fill_value
+        )
+    else:
+        whole_years = data
+    return (
+        whole_years.coarsen(year_month=12)
+        .construct(year_month=("year", "month"))
+        .drop_vars("year_month")
+        .assign_coords(
+            year=np.arange(first_year, last_year + 1), month=np.arange(1, 13)
+        )
+    )
+
+
+def calculate_monthly_means(precipitation, accumulator_dtype="float64"):
+    """
+    Calculate the mean of each month of each year as a year by month cube.
+
+    This is the only pass over the full time series the climatologies need. Data
+    with one time step per month, such as CMIP monthly means, is only rearranged by
+    index arithmetic on the time coordinate, while data with several time steps per
+    month (e.g. daily) is averaged over each month in a single grouped reduction.
+
+    Parameters
+    ----------
+    precipitation : xarray.DataArray
+        precipitation with dimensions ("time", "lat", "lon"), in time order
+    accumulator_dtype : optional str
+        floating point type to accumulate the sums of the monthly means in, and of
+        the returned days in each month
+
+    Returns
+    -------
+    monthly_means : xarray.DataArray
+        mean of each month in the type of `precipitation`, with dimensions
+        ("year", "month", "lat", "lon") covering whole years. Months without time
+        steps are zero, so that no filled copy is needed to sum over them.
+    days_in_month : xarray.DataArray
+        number of days in each month in the calendar of the time coordinate, with
+        dimensions ("year", "month"). Months without time steps have no days, so
+        they carry no weight in means over the months.
+
+    """
+    year_month = (
+        precipitation.time.dt.year * 12 + precipitation.time.dt.month - 1
+    ).rename("year_month")
+    year_month_keys, first_time_steps = np.unique(year_month.values, return_index=True)
+    days_in_month = xr.DataArray(
+        precipitation.time.dt.days_in_month.values[first_time_steps],
+        dims="year_month",
+        coords={"year_month": year_month_keys},
+    )
+
+    if year_month_keys.size == year_month.size:
+        # One time step per month, which is already the monthly mean.
+        monthly_means = (
+            precipitation.assign_coords(year_month=year_month)
+            .swap_dims(time="year_month")
+            .drop_vars("time")
+        )
+    else:
+        monthly_means = (
+            precipitation.groupby(year_month)
+            .mean("time", dtype=accumulator_dtype, keep_attrs=True)
+            .astype(precipitation.dtype)
+        )
+
+    return (
+        arrange_by_year_and_month(monthly_means),
+        arrange_by_year_and_month(days_in_month).astype(accumulator_dtype),
+    )
+
+
+def sum_season_years(data, weights):
+    """
+    Calculate weighted sums of monthly data over each season of each season year.
+
+    The season year of DJF is the year of its January and February, so December is
+    counted with the following year. The seasons are found by index arithmetic on
+    the month dimension rather than by regrouping the data: MAM, JJA and SON are
+    runs of three months within each year, split out by reshaping, while DJF adds
+    the sums of each December, moved on by one year, to those of January and
+    February.
+
+    Parameters
+    ----------
+    data : xarray.DataArray
+        monthly data with leading dimensions ("year", "month"), the months running
+        from 1 to 12
+    weights : xarray.DataArray
+        weight of each month with dimensions ("year", "month")
+
+    Returns
+    -------
+    season_year_sums : xarray.DataArray
+        weighted sums with dimensions ("season_year", "season", ...), the seasons
+        ordered as in SEASON_MONTHS. The December before the first year counts
+        as zero, and the last December, whose season year is not covered, is left
+        out.
+
+    """
+
+    def split_spring_to_autumn(monthly_data):
+        return (
+            monthly_data.isel(month=slice(2, 11))
+            .coarsen(month=3)
+            .construct(month=("season", "season_month"))
+            .drop_vars("month")
+        )
+
+    spring_to_autumn_sums = xr.dot(
+        split_spring_to_autumn(data),
+        split_spring_to_autumn(weights),
+        dim="season_month",
+    )
+    december_sums = data.isel(month=11, drop=True) * weights.isel(month=11, drop=True)
+    winter_sums = xr.dot(
+        data.isel(month=slice(0, 2)), weights.isel(month=slice(0, 2)), dim="month"
+    ) + december_sums.assign_coords(year=december_sums.year + 1).reindex(
+        year=data.year, fill_value=0
+    )
+
+    return (
+        xr.concat(
+            [winter_sums.expand_dims(season=1), spring_to_autumn_sums], dim="season"
+        )
+        .transpose("year", "season", ...)
+        .rename(year="season_year")
+        .assign_coords(season=list(SEASON_MONTHS))
+    )
+
+
+def select_complete_seasons(days_in_month):
+    """
+    Leave out the months of seasons not wholly covered by the data.
+
+    Parameters
+    ----------
+    days_in_month : xarray.DataArray
+        number of days in each month with dimensions ("year", "month"), zero for
+        months without data, as returned by calculate_monthly_means
+
+    Returns
+    -------
+    season_days_in_month : xarray.DataArray
+        `days_in_month` with no days in any month of a season of a season year
+        (see sum_season_years) missing one of its months, such as the January and
+        February of the first year when its December before is missing, or the
+        last December
+
+    """
+    has_days = days_in_month.values > 0
+    # Move on by a month, so that each season year is a run of four whole seasons.
+    season_year_months = np.concatenate([[False], has_days.ravel()[:-1]]).reshape(
+        -1, 4, 3
+    )
+    in_complete_season = np.repeat(season_year_months.all(axis=2), 3, axis=1).ravel()
+    # Move back, leaving out the last December, whose season year is not covered.
+    in_complete_season = np.append(in_complete_season[1:], False).reshape(
+        has_days.shape
+    )
+    return days_in_month.where(in_complete_season, 0)
+
+
+def divide_weighted_sums(weighted_sums, sums_of_weights, attrs):
+    """
+    Divide weighted sums by their sums of weights, giving NaN where these are zero.
+
+    Parameters
+    ----------
+    weighted_sums : xarray.DataArray
+        sums of weighted values
+    sums_of_weights : xarray.DataArray
+        sums of the weights of the values
+    attrs : dict
+        attributes to give the weighted means
+
+    Returns
+    -------
+    weighted_means : xarray.DataArray
+        the weighted means
+
+    """
+    return (weighted_sums / sums_of_weights.where(sums_of_weights > 0)).assign_attrs(
+        attrs
+    )
+
+
+def calculate_monthly_climatologies(
+    monthly_means, days_in_month, climatologies=None, season_years=False
+):
+    """
+    Derive annual means and seasonal and monthly climatologies from monthly means.
+
+    Each mean weights every month by its number of days, leaving out missing
+    values. The seasonal climatology adds up the sums over years of each month
+    over the months of each season, sharing them with the monthly climatology, so
+    the annual means and both climatologies cost two passes over the year by
+    month cube.
+
+    Parameters
+    ----------
+    monthly_means : xarray.DataArray
+        mean of each month with dimensions ("year", "month", "lat", "lon") as
+        returned by calculate_monthly_means
+    days_in_month : xarray.DataArray
+        number of days in each month with dimensions ("year", "month"), as returned
+        by calculate_monthly_means. The means accumulate in its type.
+    climatologies : optional iterable(str)
+        names of the means to derive (any of "annual", "seasonal", "monthly" and
+        "seasonal_series"). If None (default) all of them are derived.
+    season_years : optional bool
+        If True, derive the seasonal climatology from the complete seasons of each
+        season year (see sum_season_years), so that each DJF season is a
+        consecutive December, January and February. If False (default) it is
+        derived from all months of each season, with December counted in the DJF
+        season of its own year, as when grouping time steps by season.
+
+    Returns
+    -------
+    monthly_climatologies : dict(str: xarray.DataArray)
+        the requested means, in the type of `days_in_month`, of:
+        "annual" - mean of each year with dimensions ("year", "lat", "lon"),
+        "seasonal" - climatology of each season with dimensions ("season", "lat",
+        "lon"),
+        "monthly" - climatology of each month with dimensions ("month", "lat",
+        "lon"),
+        "seasonal_series" - mean of each season of each season year with
+        dimensions ("season_year", "season", "lat", "lon"). Seasons missing a
+        month are NaN.
+
+    """
+    if climatologies is None:
+        climatologies = MONTHLY_CLIMATOLOGIES
+
+    valid_values = monthly_means.notnull()
+    if monthly_means.chunks is None and bool(valid_values.all()):
+        # Nothing to leave out, so the sums of weights are the same at every grid
+        # cell and the cube need not be filled.
+        filled_means = monthly_means
+        valid_values = xr.ones_like(days_in_month)
+    else:
+        filled_means = monthly_means.where(valid_values, 0)
+        # Summed in the type of the data, as boolean masks are summed as a copy.
+        valid_values = valid_values.astype(monthly_means.dtype)
+
+    def calculate_weighted_sums(sum_function, weights):
+        # Sums of the values and of the weights of the valid values.
+        return sum_function(filled_means, weights), sum_function(valid_values, weights)
+
+    def sum_over_months(data, weights):
+        return xr.dot(data, weights, dim="month")
+
+    def sum_over_years(data, weights):
+        return xr.dot(data, weights, dim="year")
+
+    monthly_climatologies = {}
+    if "annual" in climatologies:
+        monthly_climatologies["annual"] = divide_weighted_sums(
+            *calculate_weighted_sums(sum_over_months, days_in_month),
+            monthly_means.attrs,
+        )
+    if "monthly" in climatologies or ("seasonal" in climatologies and not season_years):
+        monthly_sums, monthly_weights = calculate_weighted_sums(
+            sum_over_years, days_in_month
+        )
+    if "monthly" in climatologies:
+        monthly_climatologies["monthly"] = divide_weighted_sums(
+            monthly_sums, monthly_weights, monthly_means.attrs
+        )
+    if "seasonal" in climatologies:
+        if season_years:
+            # Only whole seasons, so each DJF is a consecutive December to February.
+            monthly_sums, monthly_weights = calculate_weighted_sums(
+                sum_over_years, select_complete_seasons(days_in_month)
+            )
+        monthly_climatologies["seasonal"] = xr.concat(
+            [
+                divide_weighted_sums(
+                    monthly_sums.sel(month=list(season_months)).sum("month"),
+                    monthly_weights.sel(month=list(season_months)).sum("month"),
+                    monthly_means.attrs,
+                )
+                for season_months in SEASON_MONTHS.values()
+            ],
+            dim="season",
+        ).assign_coords(season=list(SEASON_MONTHS))
+    if "seasonal_series" in climatologies:
+        monthly_climatologies["seasonal_series"] = divide_weighted_sums(
+            *calculate_weighted_sums(
+                sum_season_years, select_complete_seasons(days_in_month)
+            ),
+            monthly_means.attrs,
+        )
+
+    return monthly_climatologies
@@ -1,91 +1,507 @@
 """Routines for analysing precipitation climatology from ESM runs."""
 
+import argparse
+import glob
 import json
+from pathlib import Path
 
-import cartopy.crs as ccrs
-import cartopy.feature as cfeature
-import cmocean
-import matplotlib.pyplot as plt
-import matplotlib.ticker as mticker
 import numpy as np
-import regionmask
 import xarray as xr
-from cartopy.mpl.gridliner import LATITUDE_FORMATTER, LONGITUDE_FORMATTER
+from climatology_cache import (
+    MAX_RESULT_CACHE_SIZE_MB,
+    get_cached_result,
+    get_surface_mask,
+    hash_input_files,
+    use_local_natural_earth,
+)
+from grid_weights import apply_region_weights, calculate_cell_areas, get_country_weights
+from monthly_climatology import (
+    MONTHLY_CLIMATOLOGIES,
+    calculate_monthly_climatologies,
+    calculate_monthly_means,
+)
+from regridding import create_regular_grid, regrid
+from run_profile import profile_run, profile_stage
+from running_climatology import (
+    TIME_SERIES_VARIABLES,
+    calculate_running_means,
+    calculate_running_sums,
+    load_running_state,
+    save_running_state,
+    update_running_state,
+)
 
+REDUCTIONS = ("zonal", "equatorial", "annual", "seasonal", "monthly", "seasonal_series")
+# Ways of calculating the annual, seasonal and monthly means: grouping the time
+# steps for each one, or deriving all of them from a cube of monthly means.
+REDUCTION_ENGINES = ("groupby", "monthly")
+# Increase when the reductions change, so results cached by older code are not used.
+REDUCTIONS_VERSION = 3
+# Floating point types the full-resolution data can be reduced in. Single precision
+# halves the memory of the data, and sums are accumulated in ACCUMULATOR_DTYPE.
+COMPUTE_DTYPES = ("float32", "float64")
+ACCUMULATOR_DTYPE = "float64"
+# Latitude and longitude range of the band averaged for the Hovmöller diagram.
+EQUATORIAL_BAND = {"lat": (-1, 1), "lon": (120, 280)}
+# Diagnostics main() can produce, and the reduction of the data each one needs.
+DIAGNOSTIC_REDUCTIONS = {
+    "zonal": "zonal",
+    "enso": "equatorial",
+    "countries": "annual",
+    "seasonal_map": "seasonal",
+}
+# Dimensions each reduction is read along, which Zarr chunks keep whole: time series
+# for the country averages and the zonal and Hovmöller plots, maps for seasons.
+ZARR_CONTIGUOUS_DIMS = {
+    "zonal": ("time",),
+    "equatorial": ("time",),
+    "annual": ("year",),
+    "seasonal": ("lat", "lon"),
+    "monthly": ("lat", "lon"),
+    "seasonal_series": ("season_year",),
+}
+ZARR_TARGET_CHUNK_MB = 16
+
+
+def calculate_minimum_and_maximum(data_array, block_size=65536):
+    """
+    Calculate the minimum and maximum of a DataArray in a single pass over the data.
+
+    In-memory data is scanned in cache-sized blocks, computing both extremes of each
+    block before moving on. Dask-backed data is reduced chunk by chunk in a single
+    traversal of the task graph. Missing values are ignored.
+
+    Parameters
+    ----------
+    data_array : xarray.DataArray
+        data to find the extremes of
+    block_size : optional int
+        number of elements in each block for in-memory data
+
+    Returns
+    -------
+    minimum : float
+        smallest value in `data_array`, or NaN if all values are missing
+    maximum : float
+        largest value in `data_array`, or NaN if all values are missing
+
+    """
+    if data_array.chunks is not None:
+        extremes = xr.Dataset(
+            {"minimum": data_array.min(), "maximum": data_array.max()}
+        ).compute()
+        return float(extremes["minimum"]), float(extremes["maximum"])
+
+    flat_values = np.ravel(data_array.values)
+    minimum, maximum = np.nan, np.nan
+    for block_start in range(0, flat_values.size, block_size):
+        block = flat_values[block_start : block_start + block_size]
+        # fmin/fmax ignore NaNs, unlike min/max.
+        minimum = np.fmin(minimum, np.fmin.reduce(block))
+        maximum = np.fmax(maximum, np.fmax.reduce(block))
+
+    return float(minimum), float(maximum)
+
+
+def find_out_of_bounds_values(data_array, lower_bound, upper_bound, max_reported=5):
+    """
+    Locate values of a DataArray lying outside given bounds.
+
+    Parameters
+    ----------
+    data_array : xarray.DataArray
+        data to search
+    lower_bound : float
+        smallest allowed value
+    upper_bound : float
+        largest allowed value
+    max_reported : optional int
+        maximum number of offending values to return
+
+    Returns
+    -------
+    out_of_bounds_values : list(dict)
+        location of each offending value, keyed by dimension name, together with
+        the value itself under the key "value"
 
-def convert_precipitation_units(precipitation_in_kg_per_m_squared_s):
+    """
+    out_of_bounds = (data_array < lower_bound) | (data_array > upper_bound)
+    out_of_bounds_indices = np.argwhere(np.asarray(out_of_bounds))[:max_reported]
+
+    # Select all offending points at once, so lazy data is only computed for them.
+    offending_values = data_array.isel(
+        {
+            dim: xr.DataArray(out_of_bounds_indices[:, axis], dims="point")
+            for axis, dim in enumerate(data_array.dims)
+        }
+    ).compute()
+
+    out_of_bounds_values = []
+    for point, index in enumerate(out_of_bounds_indices):
+        offending_value = offending_values.isel(point=point)
+        # Report coordinate labels where available, otherwise positional indices.
+        coordinates = {
+            dim: str(offending_value[dim].values)
+            if dim in offending_value.coords
+            else position
+            for dim, position in zip(data_array.dims, index.tolist(), strict=True)
+        }
+        coordinates["value"] = offending_value.item()
+        out_of_bounds_values.append(coordinates)
+
+    return out_of_bounds_values
+
+
+def convert_precipitation_units(precipitation_in_kg_per_m_squared_s, in_place=False):
     """
     Convert precipitation units from [kg m-2 s-1] to [mm day-1].
 
+    The data is validated before conversion, by comparing its extremes from a single
+    pass to the bounds expressed in the input units, so no converted copy is needed
+    to check it.
+
     Parameters
     ----------
     precipitation_in_kg_per_m_squared_s : xarray.DataArray
         xarray DataArray containing model precipitation data in kg m-2 s-1
+    in_place : optional bool
+        If True, scale the data of the input DataArray in place rather than
+        allocating a converted copy. Ignored for dask-backed data.
 
     Returns
     -------
     precipitation_in_mm_per_day : xarray.DataArray
         the input DataArray with precipitation units modified to mm day-1
+
+    Raises
+    ------
+    ValueError
+        If any precipitation values are negative or exceed the upper bound. The
+        message gives the location and value of the first few offending values.
     """
     # density 1000 kg m-3 => 1 kg m-2 == 1 mm
     # There are 60*60*24 = 86400 seconds per day
-    precipitation_in_mm_per_day = precipitation_in_kg_per_m_squared_s * 86400
-
-    precipitation_in_mm_per_day.attrs["units"] = "mm/day"
+    seconds_per_day = 86400
 
+    precipitation_lower_bound = 0.0  # mm/day
     precipitation_upper_bound = 2000  # mm/day
 
-    if precipitation_in_mm_per_day.data.min() < 0.0:
-        raise ValueError("There is at least one negative precipitation value")
-    if precipitation_in_mm_per_day.data.max() > precipitation_upper_bound:
+    minimum, maximum = calculate_minimum_and_maximum(
+        precipitation_in_kg_per_m_squared_s
+    )
+    if (
+        minimum < precipitation_lower_bound
+        or maximum * seconds_per_day > precipitation_upper_bound
+    ):
+        out_of_bounds_values = find_out_of_bounds_values(
+            precipitation_in_kg_per_m_squared_s,
+            precipitation_lower_bound,
+            precipitation_upper_bound / seconds_per_day,
+        )
         raise ValueError(
-            f"There are precipitation values > {precipitation_upper_bound} mm/day"
+            "There are precipitation values outside the range "
+            f"[{precipitation_lower_bound}, {precipitation_upper_bound}] mm/day, "
+            f"including (in kg m-2 s-1): {out_of_bounds_values}"
         )
 
+    if in_place and precipitation_in_kg_per_m_squared_s.chunks is None:
+        precipitation_in_mm_per_day = precipitation_in_kg_per_m_squared_s
+        precipitation_in_mm_per_day.data *= seconds_per_day
+    else:
+        precipitation_in_mm_per_day = (
+            precipitation_in_kg_per_m_squared_s * seconds_per_day
+        )
+
+    precipitation_in_mm_per_day.attrs["units"] = "mm/day"
+
     return precipitation_in_mm_per_day
 
 
-def plot_zonally_averaged_precipitation(precipitation_data):
+def convert_to_mm_per_day(precipitation, in_place=False):
     """
-    Plot zonally-averaged precipitation data and save to file.
+    Convert precipitation to [mm day-1] according to its "units" attribute.
+
+    Units are carried through the pipeline as metadata, so this can be applied once
+    to the smallest reduced product rather than to the full-resolution data.
 
     Parameters
     ----------
-    precipitation_data : xarray.DataArray
-        xarray DataSet containing precipitation model data, specifying precipitation in
-        [kg m-2 s-1] at given latitudes, longitudes and time. The Dataset should contain
-        four aligned DataArrays: precipitation, latitude, longitude and time.
+    precipitation : xarray.DataArray
+        precipitation data with a "units" attribute of "kg m-2 s-1" or "mm/day"
+    in_place : optional bool
+        If True, convert in-memory data in place. See convert_precipitation_units.
 
     Returns
     -------
-    None
+    precipitation_in_mm_per_day : xarray.DataArray
+        the precipitation data in mm day-1. Data already in mm day-1 is returned
+        unchanged.
 
     """
-    zonal_precipitation = precipitation_data["pr"].mean("lon", keep_attrs=True)
+    try:
+        input_units = precipitation.attrs["units"]
+    except KeyError as exc:
+        raise KeyError("Precipitation data must have a units attribute") from exc
+
+    if input_units == "kg m-2 s-1":
+        return convert_precipitation_units(precipitation, in_place=in_place)
+    if input_units == "mm/day":
+        return precipitation
+    raise ValueError("""Input units are not 'kg m-2 s-1' or 'mm/day'""")
+
 
-    figure, axes = plt.subplots(nrows=4, ncols=1, figsize=(12, 8))
+def find_precipitation_files(precipitation_netcdf_files):
+    """
+    Find the netCDF files or Zarr stores matching each of a set of glob patterns.
 
-    zonal_precipitation.sel(lat=[0]).plot.line(ax=axes[0], hue="lat")
-    zonal_precipitation.sel(lat=[-20, 20]).plot.line(ax=axes[1], hue="lat")
-    zonal_precipitation.sel(lat=[-45, 45]).plot.line(ax=axes[2], hue="lat")
-    zonal_precipitation.sel(lat=[-70, 70]).plot.line(ax=axes[3], hue="lat")
+    Parameters
+    ----------
+    precipitation_netcdf_files : str or list(str)
+        netCDF filename or Zarr store, glob pattern (e.g. "pr_Amon_*.nc"), or list
+        of these
 
-    plt.tight_layout()
-    for axis in axes:
-        axis.set_ylim(0.0, 1.0e-4)
-        axis.grid()
-    plt.savefig("zonal.png", dpi=200)  # Save figure to file
+    Returns
+    -------
+    netcdf_file_groups : list(list(str))
+        sorted list of the files matching each entry of `precipitation_netcdf_files`
 
-    figure, axes = plt.subplots(nrows=1, ncols=1, figsize=(12, 5))
+    """
+    if isinstance(precipitation_netcdf_files, str):
+        precipitation_netcdf_files = [precipitation_netcdf_files]
 
-    zonal_precipitation.T.plot()
+    netcdf_file_groups = []
+    for file_pattern in precipitation_netcdf_files:
+        matching_files = sorted(glob.glob(file_pattern))
+        if not matching_files:
+            raise FileNotFoundError(
+                f"No netCDF files or Zarr stores found matching '{file_pattern}'"
+            )
+        netcdf_file_groups.append(matching_files)
 
-    plt.savefig("zonal_map.png", dpi=200)  # Save figure to file
+    return netcdf_file_groups
 
 
-def get_country_annual_average(precipitation_data, countries):
+def get_input_engine(input_files):
     """
-    Calculate annual precipitation averages for countries and save to file.
+    Choose the xarray backend to open a set of input files with.
+
+    Parameters
+    ----------
+    input_files : list(str)
+        netCDF files or Zarr stores (directories ending in ".zarr")
+
+    Returns
+    -------
+    engine : str or None
+        "zarr" if all inputs are Zarr stores, or None for xarray's netCDF default
+
+    """
+    is_zarr_store = [
+        Path(input_file).suffix.lower() == ".zarr" for input_file in input_files
+    ]
+    if all(is_zarr_store):
+        return "zarr"
+    if any(is_zarr_store):
+        raise ValueError(
+            "Input files must be all netCDF files or all Zarr stores, not a mixture"
+        )
+    return None
+
+
+def open_precipitation_data(precipitation_netcdf_files, chunks=None, ensemble_dim=None):
+    """
+    Open one or more netCDF files or Zarr stores of precipitation data as a dataset.
+
+    Parameters
+    ----------
+    precipitation_netcdf_files : str or list(str)
+        netCDF filename or Zarr store, glob pattern (e.g. "pr_Amon_*.nc"), or list
+        of these to read precipitation data from. Multiple inputs are opened in
+        parallel and combined into a single dataset.
+    chunks : optional dict(str: int) or str
+        Chunk sizes for each dimension passed to xarray. If None a single file is read
+        into memory as normal, and multiple files are chunked one chunk per file.
+        Zarr stores are read chunk by chunk in parallel with dask when set, so
+        chunks matching (or multiples of) the store's own chunks are best.
+    ensemble_dim : optional str
+        If set, each entry of `precipitation_netcdf_files` is treated as one ensemble
+        member (which may itself be a glob over time slices). Members are stacked
+        along a new dimension with this name and averaged to give the ensemble mean.
+        If None (default) all files are combined according to their coordinates,
+        e.g. consecutive time slices of a single run.
+
+    Returns
+    -------
+    precipitation_data : xarray.Dataset
+        xarray DataSet containing precipitation model data.
+
+    """
+    netcdf_file_groups = find_precipitation_files(precipitation_netcdf_files)
+    netcdf_files = [
+        netcdf_file for file_group in netcdf_file_groups for netcdf_file in file_group
+    ]
+    engine = get_input_engine(netcdf_files)
+
+    if ensemble_dim is not None:
+        # Each member is combined on its own, as members may be split into
+        # different numbers of time slices.
+        precipitation_data = xr.concat(
+            [
+                xr.open_mfdataset(
+                    file_group,
+                    engine=engine,
+                    combine="by_coords",
+                    chunks=chunks,
+                    parallel=True,
+                )
+                for file_group in netcdf_file_groups
+            ],
+            dim=ensemble_dim,
+        )
+        return precipitation_data.mean(ensemble_dim, keep_attrs=True)
+
+    if len(netcdf_files) == 1:
+        return xr.open_dataset(netcdf_files[0], engine=engine, chunks=chunks)
+
+    return xr.open_mfdataset(
+        netcdf_files, engine=engine, combine="by_coords", chunks=chunks, parallel=True
+    )
+
+
+def regrid_precipitation_data(precipitation_data, target_grid, cache_directory=None):
+    """
+    Regrid precipitation data onto a common regular latitude-longitude grid.
+
+    Putting the data of different models on the same grid lets their products be
+    compared and stacked. Regridding weights are cached for each pair of source
+    and target grids, so regridding many files costs a sparse matrix product.
+
+    Parameters
+    ----------
+    precipitation_data : xarray.Dataset
+        xarray Dataset containing precipitation model data "pr" on the model grid
+    target_grid : dict
+        target grid, with its "grid_spacing" in degrees and an optional regridding
+        "method" (one of "conservative" (default) or "bilinear")
+    cache_directory : optional str
+        directory to cache the regridding weights in between runs. See
+        regridding.get_regridding_weights.
+
+    Returns
+    -------
+    regridded_precipitation_data : xarray.Dataset
+        Dataset containing "pr" on the target grid, with the attributes of
+        `precipitation_data`
+
+    """
+    target_latitude, target_longitude = create_regular_grid(target_grid["grid_spacing"])
+    return xr.Dataset(
+        {
+            "pr": regrid(
+                precipitation_data["pr"],
+                target_latitude,
+                target_longitude,
+                method=target_grid.get("method", "conservative"),
+                cache_directory=cache_directory,
+            )
+        },
+        attrs=precipitation_data.attrs,
+    )
+
+
+def extract_region(data, latitude_range, longitude_range):
+    """
+    Extract the part of gridded data lying within a latitude-longitude box.
+
+    The box is selected by integer index ranges rather than by chained label
+    selections, so lazily loaded or dask-backed data only reads the hyperslab of
+    the box from disk, in one contiguous read per chunk. Longitude ranges may cross
+    the edge of the grid's longitude range (e.g. 330 to 30 on a 0 to 360 grid),
+    in which case the box is read as two hyperslabs.
+
+    Parameters
+    ----------
+    data : xarray.DataArray
+        data with "lat" and "lon" dimensions, longitudes in degrees
+    latitude_range : tuple(float, float)
+        southern and northern edges of the box in degrees, inclusive
+    longitude_range : tuple(float, float)
+        western and eastern edges of the box in degrees east, inclusive. The box
+        extends eastwards from the western edge, around the whole circle if the
+        eastern edge is a full circle or more east of it (e.g. 0 to 360).
+
+    Returns
+    -------
+    region_data : xarray.DataArray
+        data within the box. Longitudes increase continuously eastwards from the
+        western edge, so they may exceed 360 for boxes that wrap around.
+
+    """
+    southern_edge, northern_edge = latitude_range
+    western_edge, eastern_edge = longitude_range
+
+    latitude_indices = np.flatnonzero(
+        (data.lat.values >= southern_edge) & (data.lat.values <= northern_edge)
+    )
+    # Degrees east of the western edge, so that boxes wrapping around are handled.
+    longitude_offsets = (data.lon.values - western_edge) % 360
+    longitude_width = eastern_edge - western_edge
+    if longitude_width < 360:
+        longitude_width %= 360
+    longitude_indices = np.flatnonzero(longitude_offsets <= longitude_width)
+    longitude_indices = longitude_indices[
+        np.argsort(longitude_offsets[longitude_indices], kind="stable")
+    ]
+    if latitude_indices.size == 0 or longitude_indices.size == 0:
+        raise ValueError(
+            f"No grid cells in latitudes {latitude_range} and "
+            f"longitudes {longitude_range}"
+        )
+
+    # Split the longitudes into runs of consecutive indices, one hyperslab each.
+    longitude_runs = np.split(
+        longitude_indices, np.flatnonzero(np.diff(longitude_indices) != 1) + 1
+    )
+    latitude_slice = slice(latitude_indices.min(), latitude_indices.max() + 1)
+    region_data = xr.concat(
+        [
+            data.isel(lat=latitude_slice, lon=slice(run[0], run[-1] + 1))
+            for run in longitude_runs
+        ],
+        dim="lon",
+    )
+
+    return region_data.assign_coords(
+        lon=western_edge + longitude_offsets[np.concatenate(longitude_runs)]
+    )
+
+
+def calculate_precipitation_reductions(
+    precipitation_data,
+    reductions=None,
+    equatorial_band=None,
+    compute_dtype="float32",
+    reduction_engine="groupby",
+    *,
+    season_years=False,
+):
+    """
+    Calculate the reductions of the precipitation data needed by the diagnostics.
+
+    The reductions are built lazily and then evaluated together, so that when the
+    data is chunked with dask the input is only traversed once for all of them.
+    The data is kept in `compute_dtype` throughout, while the sums behind each
+    mean are accumulated in ACCUMULATOR_DTYPE, so single precision data is never
+    copied to double precision at full resolution but its means do not lose
+    accuracy over long runs.
+
+    With the "monthly" `reduction_engine`, the annual, seasonal and monthly means
+    are all derived from a year by month cube of monthly means, calculated in one
+    pass over the data, with each month weighted by its number of days. See
+    monthly_climatology.calculate_monthly_climatologies. The seasonal means of each
+    season year, and the seasonal climatology with `season_years`, are always
+    derived from the monthly means, with each DJF season a consecutive December,
+    January and February.
 
     Parameters
     ----------
@@ -93,159 +509,801 @@ def get_country_annual_average(precipitation_data, countries):
         xarray DataSet containing precipitation model data, specifying precipitation in
         [kg m-2 s-1] at given latitudes, longitudes and time. The Dataset should contain
         four aligned DataArrays: precipitation, latitude, longitude and time.
+    reductions : optional iterable(str)
+        names of the reductions to calculate (any of "zonal", "equatorial",
+        "annual", "seasonal", "monthly" and "seasonal_series"). If None (default)
+        all of them are calculated.
+    equatorial_band : optional dict(str: tuple(float, float))
+        "lat" and "lon" ranges of the band averaged for the "equatorial" reduction.
+        Defaults to EQUATORIAL_BAND, the equatorial Pacific.
+    compute_dtype : optional str
+        floating point type to reduce the data in and return the reductions in (one
+        of "float32" (default) or "float64"). Data of another type is cast first.
+    reduction_engine : optional str
+        how to calculate the annual, seasonal and monthly means (one of "groupby"
+        (default), which averages the time steps of each year, season or month, or
+        "monthly", which derives them from monthly means weighted by days)
+    season_years : optional bool
+        If True, calculate the seasonal climatology from complete seasons of each
+        season year, counting December with the following January and February.
+        If False (default), December is counted with the January and February of
+        its own year, as when grouping time steps by season.
+
+    Returns
+    -------
+    precipitation_reductions : xarray.Dataset
+        Dataset of reduced precipitation data in the input units and
+        `compute_dtype` containing the requested variables of:
+        "zonal" - area-weighted zonal (longitude) mean with dimensions ("time", "lat"),
+        "equatorial" - area-weighted mean over the latitudes of `equatorial_band`,
+        with dimensions ("time", "equatorial_lon"),
+        "annual" - annual mean with dimensions ("year", "lat", "lon"),
+        "seasonal" - seasonal mean with dimensions ("season", "lat", "lon"),
+        "monthly" - monthly mean with dimensions ("month", "lat", "lon"),
+        "seasonal_series" - mean of each complete season of each season year with
+        dimensions ("season_year", "season", "lat", "lon"), where DJF of a season
+        year runs from the December before.
+
+    """
+    if reductions is None:
+        reductions = REDUCTIONS
+    if equatorial_band is None:
+        equatorial_band = EQUATORIAL_BAND
+    unknown_reductions = set(reductions) - set(REDUCTIONS)
+    if unknown_reductions:
+        raise ValueError(
+            f"Unknown reductions {sorted(unknown_reductions)}, "
+            f"expected any of {list(REDUCTIONS)}"
+        )
+    if compute_dtype not in COMPUTE_DTYPES:
+        raise ValueError(
+            f"Compute dtype must be one of {COMPUTE_DTYPES}, not '{compute_dtype}'"
+        )
+    if reduction_engine not in REDUCTION_ENGINES:
+        raise ValueError(
+            f"Reduction engine must be one of {REDUCTION_ENGINES}, "
+            f"not '{reduction_engine}'"
+        )
+
+    precipitation = precipitation_data["pr"].astype(compute_dtype, copy=False)
+    # Weighted means accumulate in the type of the weights.
+    cell_areas = calculate_cell_areas(precipitation.lat, precipitation.lon).astype(
+        ACCUMULATOR_DTYPE
+    )
+
+    precipitation_reductions = xr.Dataset(attrs=precipitation_data.attrs)
+    if "zonal" in reductions:
+        precipitation_reductions["zonal"] = precipitation.weighted(cell_areas).mean(
+            "lon", keep_attrs=True
+        )
+    if "equatorial" in reductions:
+        # Rename the band's longitude so it is not aligned to the full grid.
+        precipitation_reductions["equatorial"] = (
+            extract_region(
+                precipitation, equatorial_band["lat"], equatorial_band["lon"]
+            )
+            .weighted(
+                extract_region(
+                    cell_areas, equatorial_band["lat"], equatorial_band["lon"]
+                )
+            )
+            .mean(dim="lat", keep_attrs=True)
+            .rename(lon="equatorial_lon")
+        )
+    if reduction_engine == "groupby":
+        for reduction, group in (
+            ("annual", "time.year"),
+            ("seasonal", "time.season"),
+            ("monthly", "time.month"),
+        ):
+            if reduction in reductions and not (
+                reduction == "seasonal" and season_years
+            ):
+                precipitation_reductions[reduction] = precipitation.groupby(group).mean(
+                    "time", dtype=ACCUMULATOR_DTYPE, keep_attrs=True
+                )
+    # Season years cannot be grouped by a time component, so always use the cube.
+    monthly_climatologies = [
+        reduction
+        for reduction in MONTHLY_CLIMATOLOGIES
+        if reduction in reductions and reduction not in precipitation_reductions
+    ]
+    if monthly_climatologies:
+        precipitation_reductions.update(
+            calculate_monthly_climatologies(
+                *calculate_monthly_means(
+                    precipitation, accumulator_dtype=ACCUMULATOR_DTYPE
+                ),
+                climatologies=monthly_climatologies,
+                season_years=season_years,
+            )
+        )
+
+    for variable, reduction in precipitation_reductions.data_vars.items():
+        precipitation_reductions[variable] = reduction.astype(compute_dtype)
+
+    return precipitation_reductions.compute()
+
+
+def get_precipitation_reductions(
+    precipitation_netcdf_files,
+    reductions=None,
+    *,
+    chunks=None,
+    ensemble_dim=None,
+    equatorial_band=None,
+    target_grid=None,
+    compute_dtype="float32",
+    reduction_engine="groupby",
+    season_years=False,
+    cache_directory=None,
+    max_cache_size_mb=MAX_RESULT_CACHE_SIZE_MB,
+):
+    """
+    Get the reductions of precipitation files, reading the data only if not cached.
+
+    Results are cached on disk keyed by the identity of the input files (path, size
+    and modification time) and the reduction parameters, so runs that only change
+    how the results are plotted skip reading and reducing the data.
+
+    Parameters
+    ----------
+    precipitation_netcdf_files : str or list(str)
+        netCDF filename, glob pattern, or list of these to read precipitation data
+        from. See open_precipitation_data.
+    reductions : optional iterable(str)
+        names of the reductions to calculate. See calculate_precipitation_reductions.
+    chunks : optional dict(str: int) or str
+        Chunk sizes for each dimension. See open_precipitation_data.
+    ensemble_dim : optional str
+        If set, analyse the ensemble mean of the files. See open_precipitation_data.
+    equatorial_band : optional dict(str: tuple(float, float))
+        band averaged for the "equatorial" reduction. See
+        calculate_precipitation_reductions.
+    target_grid : optional dict
+        If set, regrid the data onto this grid before reducing it. See
+        regrid_precipitation_data.
+    compute_dtype : optional str
+        floating point type to reduce the data in. See
+        calculate_precipitation_reductions.
+    reduction_engine : optional str
+        how to calculate the annual, seasonal and monthly means. See
+        calculate_precipitation_reductions.
+    season_years : optional bool
+        If True, count December with the following DJF season. See
+        calculate_precipitation_reductions.
+    cache_directory : optional str or pathlib.Path
+        directory to cache results (and regridding weights) in between runs. See
+        climatology_cache.get_cached_result.
+    max_cache_size_mb : optional float
+        maximum total size of cached results, or 0 to bypass the cache
+
+    Returns
+    -------
+    precipitation_reductions : xarray.Dataset
+        Dataset of reduced precipitation data in the input units. See
+        calculate_precipitation_reductions.
+
+    """
+    if reductions is None:
+        reductions = REDUCTIONS
+    if equatorial_band is None:
+        equatorial_band = EQUATORIAL_BAND
+
+    netcdf_file_groups = find_precipitation_files(precipitation_netcdf_files)
+    cache_key = hash_input_files(
+        [
+            netcdf_file
+            for file_group in netcdf_file_groups
+            for netcdf_file in file_group
+        ],
+        file_groups=[len(file_group) for file_group in netcdf_file_groups],
+        reductions=sorted(reductions),
+        ensemble_dim=ensemble_dim,
+        equatorial_band={
+            dimension: list(edges) for dimension, edges in equatorial_band.items()
+        },
+        target_grid=target_grid,
+        compute_dtype=compute_dtype,
+        reduction_engine=reduction_engine,
+        season_years=season_years,
+        version=REDUCTIONS_VERSION,
+    )
+
+    def calculate_reductions():
+        with profile_stage("open"):
+            precipitation_data = open_precipitation_data(
+                precipitation_netcdf_files, chunks=chunks, ensemble_dim=ensemble_dim
+            )
+        if target_grid is not None:
+            with profile_stage("regrid"):
+                precipitation_data = regrid_precipitation_data(
+                    precipitation_data, target_grid, cache_directory=cache_directory
+                )
+        with profile_stage("compute"):
+            return calculate_precipitation_reductions(
+                precipitation_data,
+                reductions=reductions,
+                equatorial_band=equatorial_band,
+                compute_dtype=compute_dtype,
+                reduction_engine=reduction_engine,
+                season_years=season_years,
+            )
+
+    return get_cached_result(
+        cache_key,
+        calculate_reductions,
+        cache_directory=cache_directory,
+        max_cache_size_mb=max_cache_size_mb,
+    )
+
+
+def update_precipitation_reductions(
+    precipitation_data,
+    state_file,
+    equatorial_band=None,
+    compute_dtype="float32",
+    *,
+    target_grid=None,
+    cache_directory=None,
+):
+    """
+    Update the reductions of the precipitation data with only its new time steps.
+
+    Running sums and counts of the annual and seasonal means, together with the
+    zonal and equatorial time series, are kept in `state_file`. Only the time steps
+    later than those already in the state are read, and the state is then updated
+    and saved in place, so extending a model run does not mean reprocessing it.
+
+    Parameters
+    ----------
+    precipitation_data : xarray.Dataset
+        xarray Dataset containing precipitation model data, specifying precipitation
+        in [kg m-2 s-1] at given latitudes, longitudes and time, covering at least
+        all time steps not yet in the state
+    state_file : str or pathlib.Path
+        netCDF file holding the running state. It is created on the first run.
+    equatorial_band : optional dict(str: tuple(float, float))
+        band averaged for the "equatorial" reduction. See
+        calculate_precipitation_reductions. It must not change between updates of
+        the same state.
+    compute_dtype : optional str
+        floating point type to reduce the new time steps in. See
+        calculate_precipitation_reductions. The running sums are always kept in
+        double precision.
+    target_grid : optional dict
+        grid to regrid the new time steps onto before reducing them, so that only
+        those are read and regridded. See regrid_precipitation_data. It must not
+        change between updates of the same state.
+    cache_directory : optional str
+        directory to cache the regridding weights in. See
+        regrid_precipitation_data.
+
+    Returns
+    -------
+    precipitation_reductions : xarray.Dataset
+        Dataset of all reductions over every time step processed so far, in the
+        input units. See calculate_precipitation_reductions.
+
+    """
+    if equatorial_band is None:
+        equatorial_band = EQUATORIAL_BAND
+    band_edges = [
+        edge for dimension in ("lat", "lon") for edge in equatorial_band[dimension]
+    ]
+
+    running_state = load_running_state(state_file)
+
+    if running_state is not None:
+        if list(np.atleast_1d(running_state.attrs["equatorial_band"])) != band_edges:
+            raise ValueError(
+                f"Equatorial band {equatorial_band} differs from the band of the "
+                f"running state in '{state_file}'. Use a new state file."
+            )
+        last_time = running_state["zonal"].time.values[-1]
+        new_time_steps = (precipitation_data.time > last_time).values
+        precipitation_data = precipitation_data.isel(time=new_time_steps)
+
+    if target_grid is not None:
+        # Regridded after selecting the new time steps, so only those are read.
+        with profile_stage("regrid"):
+            precipitation_data = regrid_precipitation_data(
+                precipitation_data, target_grid, cache_directory=cache_directory
+            )
+
+    if running_state is not None and not (
+        np.array_equal(running_state.lat, precipitation_data.lat)
+        and np.array_equal(running_state.lon, precipitation_data.lon)
+    ):
+        raise ValueError(
+            f"The grid of the data differs from the grid of the running state in "
+            f"'{state_file}'. Use a new state file."
+        )
+
+    if precipitation_data.sizes["time"] > 0:
+        if not precipitation_data.chunks:
+            # Read the new slice once, rather than once for each reduction.
+            with profile_stage("read"):
+                precipitation_data = precipitation_data.load()
+
+        with profile_stage("compute"):
+            new_running_state = calculate_precipitation_reductions(
+                precipitation_data,
+                reductions=TIME_SERIES_VARIABLES,
+                equatorial_band=equatorial_band,
+                compute_dtype=compute_dtype,
+            ).merge(
+                calculate_running_sums(
+                    precipitation_data["pr"].astype(compute_dtype, copy=False)
+                ).compute()
+            )
+        # Record the band, so a state is not extended with a different one.
+        new_running_state.attrs["equatorial_band"] = band_edges
+        running_state = update_running_state(running_state, new_running_state)
+        save_running_state(running_state, state_file)
+    elif running_state is None:
+        raise ValueError("No precipitation time steps to start the running state from")
+
+    precipitation_reductions = xr.Dataset(
+        {variable: running_state[variable] for variable in TIME_SERIES_VARIABLES},
+        attrs=running_state.attrs,
+    )
+    for variable, running_mean in calculate_running_means(running_state).items():
+        precipitation_reductions[variable] = running_mean
+
+    return precipitation_reductions
+
+
+def calculate_zarr_chunks(data_array, contiguous_dims, target_chunk_mb=None):
+    """
+    Choose Zarr chunk sizes that keep some dimensions of an array whole.
+
+    The dimensions in `contiguous_dims` span each chunk entirely, so reading along
+    them (e.g. a time series at one grid cell, or a whole map) touches as few
+    chunks as possible. The remaining dimensions are split, the leading ones first,
+    so that chunks are at most about `target_chunk_mb`.
+
+    Parameters
+    ----------
+    data_array : xarray.DataArray
+        array to be written
+    contiguous_dims : iterable(str)
+        dimensions to keep whole within each chunk
+    target_chunk_mb : optional float
+        approximate size of each chunk. Defaults to ZARR_TARGET_CHUNK_MB.
+
+    Returns
+    -------
+    chunks : tuple(int)
+        chunk size along each dimension of `data_array`, in order
+
+    """
+    if target_chunk_mb is None:
+        target_chunk_mb = ZARR_TARGET_CHUNK_MB
+
+    chunk_sizes = dict(data_array.sizes)
+    chunk_bytes = data_array.dtype.itemsize * int(
+        np.prod([data_array.sizes[dim] for dim in contiguous_dims])
+    )
+    # Fill chunks from the trailing (fastest varying) dimensions inwards.
+    for dim in reversed(data_array.dims):
+        if dim in contiguous_dims:
+            continue
+        chunk_sizes[dim] = int(
+            np.clip(target_chunk_mb * 1024**2 // chunk_bytes, 1, data_array.sizes[dim])
+        )
+        chunk_bytes *= chunk_sizes[dim]
+
+    return tuple(chunk_sizes[dim] for dim in data_array.dims)
+
+
+def save_reductions_to_zarr(precipitation_reductions, store, contiguous_dims=None):
+    """
+    Save reductions of the precipitation data to a Zarr store in [mm day-1].
+
+    Each variable is chunked for the way it is read: time-contiguous for the annual
+    means and time series, which are read a region at a time (e.g. by
+    calculate_country_annual_average), and space-contiguous for the seasonal
+    maps, which are read a whole map at a time. Any existing store is replaced.
+
+    Parameters
+    ----------
+    precipitation_reductions : xarray.Dataset
+        reductions as returned by calculate_precipitation_reductions
+    store : str or pathlib.Path
+        directory of the Zarr store, conventionally ending in ".zarr"
+    contiguous_dims : optional dict(str: tuple(str))
+        dimensions to keep whole in the chunks of each variable. Defaults to
+        ZARR_CONTIGUOUS_DIMS.
+
+    Returns
+    -------
+    None
+
+    """
+    if contiguous_dims is None:
+        contiguous_dims = ZARR_CONTIGUOUS_DIMS
+
+    reductions_in_mm_per_day = xr.Dataset(attrs=precipitation_reductions.attrs)
+    for variable, reduction in precipitation_reductions.data_vars.items():
+        reductions_in_mm_per_day[variable] = convert_to_mm_per_day(reduction)
+    # Drop encodings from the input files, so they do not override the chunks.
+    reductions_in_mm_per_day = reductions_in_mm_per_day.drop_encoding()
+
+    reductions_in_mm_per_day.to_zarr(
+        store,
+        mode="w",
+        encoding={
+            variable: {
+                "chunks": calculate_zarr_chunks(reduction, contiguous_dims[variable])
+            }
+            for variable, reduction in reductions_in_mm_per_day.data_vars.items()
+        },
+    )
+
+
+def calculate_country_annual_average(
+    annual_average_precipitation, countries, cache_directory=None
+):
+    """
+    Calculate annual precipitation averages for a set of countries.
+
+    Each country mean is weighted by the area of each grid cell lying within the
+    country. All country and year means are computed together as a single sparse
+    matrix product with precomputed, cached country weights, rather than masking
+    the full grid separately for each country and year. Units are converted on the
+    resulting table rather than on the gridded data.
+
+    Parameters
+    ----------
+    annual_average_precipitation : xarray.DataArray
+        Annual average precipitation in [kg m-2 s-1] or [mm day-1] at given years,
+        latitudes and longitudes.
     countries : dict(str: str)
         dictionary mapping country names to regionmask codes. For a list see:
         regionmask.defined_regions.natural_earth_v5_0_0.countries_110.regions
+    cache_directory : optional str
+        directory to cache country weights in between runs. See
+        grid_weights.get_country_weights.
 
     Returns
     -------
-    None
+    country_annual_average_precipitation : xarray.DataArray
+        Table of annual average precipitation in [mm day-1] with dimensions
+        ("country", "year"), ordered as in `countries`. Countries not covered by any
+        grid cell are filled with NaN.
 
     """
-    annual_average_precipitation = (
-        precipitation_data["pr"].groupby("time.year").mean("time", keep_attrs=True)
-    )
-    annual_average_precipitation = convert_precipitation_units(
-        annual_average_precipitation
-    )
+    with profile_stage("weights"):
+        country_weights, region_codes = get_country_weights(
+            annual_average_precipitation.lat,
+            annual_average_precipitation.lon,
+            cache_directory=cache_directory,
+        )
+    try:
+        country_rows = [region_codes.index(code) for code in countries.values()]
+    except ValueError as exc:
+        raise KeyError(f"Unknown country code in {list(countries.values())}") from exc
 
-    country_mask = regionmask.defined_regions.natural_earth_v5_0_0.countries_110.mask(
-        annual_average_precipitation
+    country_annual_average_precipitation = xr.DataArray(
+        apply_region_weights(
+            country_weights[country_rows],
+            annual_average_precipitation.transpose("year", "lat", "lon"),
+        ).T,
+        dims=("country", "year"),
+        coords={
+            "country": list(countries),
+            "year": annual_average_precipitation.year.values,
+        },
+        attrs=dict(annual_average_precipitation.attrs),
     )
 
-    with open(
-        "annual_average_precipitation_by_country.txt", "w", encoding="utf-8"
-    ) as datafile:
-        for country_name, country_code in countries.items():
-            country_annual_average_precipitation = annual_average_precipitation.where(
-                country_mask.cf == country_code
+    return convert_to_mm_per_day(country_annual_average_precipitation, in_place=True)
+
+
+def write_country_annual_average(
+    country_annual_average_precipitation,
+    output_file="annual_average_precipitation_by_country.txt",
+):
+    """
+    Write a table of country annual average precipitation to a text file.
+
+    Parameters
+    ----------
+    country_annual_average_precipitation : xarray.DataArray
+        Annual average precipitation in [mm day-1] with dimensions ("country", "year")
+        as returned by calculate_country_annual_average.
+    output_file : optional str
+        filename to write the table to
+
+    Returns
+    -------
+    None
+
+    """
+    report_lines = []
+    for country_name, country_precipitation in zip(
+        country_annual_average_precipitation.country.values,
+        country_annual_average_precipitation.values,
+        strict=True,
+    ):
+        report_lines.extend(
+            f"{country_name.ljust(25)} {year} : {precipitation:2.3f} mm/day\n"
+            for year, precipitation in zip(
+                country_annual_average_precipitation.year.values,
+                country_precipitation,
+                strict=True,
             )
+        )
+        report_lines.append("\n")
 
-            for year in country_annual_average_precipitation.year.values:
-                precipitation = (
-                    country_annual_average_precipitation.sel(year=year).mean().values
-                )
-                datafile.write(
-                    f"{country_name.ljust(25)} {year} : {precipitation:2.3f} mm/day\n"
-                )
-            datafile.write("\n")
+    with open(output_file, "w", encoding="utf-8") as datafile:
+        datafile.write("".join(report_lines))
 
 
-def plot_enso_hovmoller_diagram(precipitation_data):
+def save_country_annual_average(country_annual_average_precipitation, output_file):
     """
-    Plot Hovmöller diagram of equatorial precipitation to visualise ENSO.
+    Save a table of country annual average precipitation in a columnar format.
+
+    The format is chosen from the file extension. The table is written in one bulk
+    write from the reduced array, as a long table with one row per country and year
+    for ".csv" and ".parquet", or as the ("country", "year") array for ".nc" and
+    ".zarr". Zarr chunks hold the whole time series of each country. A ".txt" file
+    gets the human readable report of write_country_annual_average.
 
     Parameters
     ----------
-    precipitation_data : xarray.DataArray
-       xarray DataSet containing precipitation model data, specifying precipitation in
-        [kg m-2 s-1] at given latitudes, longitudes and time. The Dataset should contain
-        four aligned DataArrays: precipitation, latitude, longitude and time.
+    country_annual_average_precipitation : xarray.DataArray
+        Annual average precipitation in [mm day-1] with dimensions ("country", "year")
+        as returned by calculate_country_annual_average.
+    output_file : str or pathlib.Path
+        filename to write the table to, ending in ".csv", ".parquet" (needs pyarrow
+        or fastparquet), ".nc", ".zarr" or ".txt"
 
     Returns
     -------
     None
 
     """
-    enso = (
-        precipitation_data["pr"]
-        .sel(lat=slice(-1, 1))
-        .sel(lon=slice(120, 280))
-        .mean(dim="lat", keep_attrs=True)
+    file_format = Path(output_file).suffix.lower()
+
+    if file_format == ".txt":
+        write_country_annual_average(country_annual_average_precipitation, output_file)
+        return
+    if file_format == ".nc":
+        country_annual_average_precipitation.rename("pr").to_netcdf(output_file)
+        return
+    if file_format == ".zarr":
+        save_reductions_to_zarr(
+            xr.Dataset({"country_annual": country_annual_average_precipitation}),
+            output_file,
+            contiguous_dims={"country_annual": ("year",)},
+        )
+        return
+    if file_format not in {".csv", ".parquet"}:
+        raise ValueError(
+            f"Unsupported country table format '{file_format}' for '{output_file}', "
+            "expected one of .csv, .parquet, .nc, .zarr or .txt"
+        )
+
+    country_table = (
+        country_annual_average_precipitation.rename("pr").to_dataframe().reset_index()
     )
+    if file_format == ".csv":
+        country_table.to_csv(output_file, index=False, float_format="%.6g")
+    else:
+        country_table.to_parquet(output_file, index=False)
+
+
+def get_country_annual_average(
+    annual_average_precipitation,
+    countries,
+    cache_directory=None,
+    output_files=("annual_average_precipitation_by_country.txt",),
+):
+    """
+    Calculate annual precipitation averages for countries and save to file.
+
+    Parameters
+    ----------
+    annual_average_precipitation : xarray.DataArray
+        Annual average precipitation in [kg m-2 s-1] or [mm day-1] at given years,
+        latitudes and longitudes.
+    countries : dict(str: str)
+        dictionary mapping country names to regionmask codes. For a list see:
+        regionmask.defined_regions.natural_earth_v5_0_0.countries_110.regions
+    cache_directory : optional str
+        directory to cache country weights in between runs. See
+        grid_weights.get_country_weights.
+    output_files : optional iterable(str)
+        files to save the table to, in the formats given by their extensions. See
+        save_country_annual_average. Defaults to the text report only.
+
+    Returns
+    -------
+    None
 
-    enso.plot()
-    plt.savefig("enso.png", dpi=200)  # Save figure to file
+    """
+    country_annual_average_precipitation = calculate_country_annual_average(
+        annual_average_precipitation, countries, cache_directory=cache_directory
+    )
+    for output_file in output_files:
+        save_country_annual_average(country_annual_average_precipitation, output_file)
 
 
-def create_precipitation_climatology_plot(
-    seasonal_average_precipitation,
+def create_figure_tasks(
+    precipitation_reductions,
+    diagnostics,
+    *,
     model_name,
     season,
+    output_file,
     mask=None,
     plot_gridlines=False,
-    levels=None,
+    cbar_levels=None,
+    cache_directory=None,
 ):
     """
-    Plot the precipitation climatology.
+    Create the figure rendering tasks for the selected diagnostics.
+
+    The reductions the figures need are converted to [mm day-1] in place.
 
     Parameters
     ----------
-    seasonal_average_precipitation : xarray.DataArray
-        Precipitation climatology data. Seasonally averaged precipitation data.
+    precipitation_reductions : xarray.Dataset
+        reductions of the precipitation data as returned by
+        calculate_precipitation_reductions, in the input units
+    diagnostics : iterable(str)
+        diagnostics to create figures for. See main.
     model_name : str
-        Name of the climate model
-    season : str
-        Climatological season (one of DJF, MAM, JJA, SON)
+        name of the model the data came from
+    season : str or list(str)
+        season or seasons to plot climatological maps of. See main.
+    output_file : str
+        filename to save the seasonal map to
     mask : optional str
-        mask to apply to plot (one of "land" or "ocean")
-    plot_gridlines : bool
-
-        Select whether to plot gridlines
-    levels : list
-        Tick mark values for the colorbar
+        mask to apply to the seasonal map (one of "land" or "ocean")
+    plot_gridlines : optional bool
+        Select whether to plot gridlines on the seasonal map
+    cbar_levels : optional list
+        Tick mark values for the colorbar of the seasonal map
+    cache_directory : optional str
+        directory to cache the rasterised mask in. See
+        climatology_cache.get_surface_mask.
 
     Returns
     -------
-    None
+    figure_tasks : list(tuple)
+        (plotting function, arguments, keyword arguments) of each figure to draw,
+        as taken by climatology_plots.render_figures. Empty if no figure is needed.
 
     """
-    if not levels:
-        levels = np.arange(0, 13.5, 1.5)
+    figure_tasks = []
+    if not {"zonal", "enso", "seasonal_map"} & set(diagnostics):
+        return figure_tasks
 
-    fig, geo_axes = plt.subplots(
-        nrows=1,
-        ncols=1,
-        figsize=(12, 5),
-        subplot_kw={"projection": ccrs.PlateCarree(central_longitude=180)},
-    )
+    # Plotting libraries are slow to import, so only load them when drawing.
+    import climatology_plots  # noqa: PLC0415
 
-    seasonal_average_precipitation.sel(season=season).plot.contourf(
-        ax=geo_axes,
-        levels=levels,
-        extend="max",
-        transform=ccrs.PlateCarree(),
-        cbar_kwargs={"label": seasonal_average_precipitation.units},
-        cmap=cmocean.cm.rain,
-    )
+    # Convert units only now, on the reduced products main() owns.
+    if "zonal" in diagnostics:
+        with profile_stage("convert_units"):
+            zonal_precipitation = convert_to_mm_per_day(
+                precipitation_reductions["zonal"], in_place=True
+            )
+        figure_tasks.append(
+            (
+                climatology_plots.plot_zonally_averaged_precipitation,
+                (zonal_precipitation,),
+                {},
+            )
+        )
 
-    geo_axes.add_feature(
-        cfeature.COASTLINE, lw=2
-    )  # Add coastines using cartopy feature
-
-    if mask:
-        # Mask out (fade) using 110m resolution data from cartopy.
-        geo_axes.add_feature(
-            cfeature.NaturalEarthFeature("physical", mask, "110m"),
-            ec=None,
-            fc="white",
-            lw=2,
-            alpha=0.75,
+    if "enso" in diagnostics:
+        with profile_stage("convert_units"):
+            equatorial_precipitation = convert_to_mm_per_day(
+                precipitation_reductions["equatorial"], in_place=True
+            )
+        figure_tasks.append(
+            (
+                climatology_plots.plot_enso_hovmoller_diagram,
+                (equatorial_precipitation.rename(equatorial_lon="lon"),),
+                {},
+            )
         )
 
-    if plot_gridlines:
-        gridlines = geo_axes.gridlines(
-            crs=ccrs.PlateCarree(),
-            draw_labels=True,
-            linewidth=2,
-            color="gray",
-            alpha=0.5,
-            linestyle="--",
+    if "seasonal_map" in diagnostics:
+        with profile_stage("convert_units"):
+            seasonal_average_precipitation = convert_to_mm_per_day(
+                precipitation_reductions["seasonal"], in_place=True
+            )
+        # Rasterise the plot mask here, so render workers are handed the small result.
+        surface_mask = None
+        if mask:
+            with profile_stage("surface_mask"):
+                surface_mask = get_surface_mask(
+                    seasonal_average_precipitation.lat,
+                    seasonal_average_precipitation.lon,
+                    mask,
+                    cache_directory=cache_directory,
+                )
+        figure_tasks.append(
+            (
+                climatology_plots.save_precipitation_climatology_plot,
+                (
+                    seasonal_average_precipitation,
+                    model_name,
+                    season,
+                    output_file,
+                ),
+                {
+                    "mask": surface_mask,
+                    "plot_gridlines": plot_gridlines,
+                    "levels": cbar_levels,
+                },
+            )
         )
-        gridlines.top_labels = False
-        gridlines.left_labels = True
-        # gl.xlines = False
-        gridlines.xlocator = mticker.FixedLocator([-180, -90, 0, 90, 180])
-        gridlines.ylocator = mticker.FixedLocator(
-            [-66, -23, 0, 23, 66]
-        )  # Tropics & Polar Circles
-        gridlines.xformatter = LONGITUDE_FORMATTER
-        gridlines.yformatter = LATITUDE_FORMATTER
-        gridlines.xlabel_style = {"size": 15, "color": "gray"}
-        gridlines.ylabel_style = {"size": 15, "color": "gray"}
-
-    title = f"{model_name} precipitation climatology ({season})"
-    plt.title(title)
+
+    return figure_tasks
+
+
+def format_run_summary(run_summary, baseline_run_summary=None):
+    """
+    Format the timings of a run of main() as a short human readable report.
+
+    Parameters
+    ----------
+    run_summary : dict
+        run summary as returned by main
+    baseline_run_summary : optional dict
+        run summary of an earlier run producing at least the diagnostics of this
+        run, e.g. one with all diagnostics enabled, to show the time saved by
+        skipping the others. The time saved is not reported against a baseline
+        run missing any diagnostic of this run.
+
+    Returns
+    -------
+    report : str
+        multi-line report of the run
+
+    """
+    report_lines = [
+        f"Diagnostics run: {', '.join(run_summary['diagnostics']) or 'none'}",
+        f"Diagnostics skipped: {', '.join(run_summary['skipped_diagnostics']) or 'none'}",
+    ]
+    report_lines.extend(
+        f"  {stage:<14} {stage_seconds:8.2f} s"
+        for stage, stage_seconds in run_summary["stage_seconds"].items()
+    )
+    report_lines.append(f"  {'total':<14} {run_summary['total_seconds']:8.2f} s")
+
+    if baseline_run_summary is not None:
+        missing_diagnostics = [
+            diagnostic
+            for diagnostic in run_summary["diagnostics"]
+            if diagnostic not in baseline_run_summary["diagnostics"]
+        ]
+        if missing_diagnostics:
+            report_lines.append(
+                "Time saved not reported, as the baseline run did not produce "
+                f"{', '.join(missing_diagnostics)}"
+            )
+        else:
+            newly_skipped_diagnostics = [
+                diagnostic
+                for diagnostic in baseline_run_summary["diagnostics"]
+                if diagnostic not in run_summary["diagnostics"]
+            ]
+            time_saved = (
+                baseline_run_summary["total_seconds"] - run_summary["total_seconds"]
+            )
+            report_lines.append(
+                "Time saved by skipping "
+                f"{', '.join(newly_skipped_diagnostics) or 'none'} "
+                f"compared to the baseline run: {time_saved:.2f} s"
+            )
+
+    return "\n".join(report_lines)
 
 
 def main(
@@ -256,16 +1314,37 @@ def main(
     mask=None,
     cbar_levels=None,
     countries=None,
+    *,
+    chunks=None,
+    ensemble_dim=None,
+    cache_directory=None,
+    render_workers=None,
+    natural_earth_directory=None,
+    diagnostics=None,
+    country_output_files=None,
+    incremental_state_file=None,
+    result_cache_size_mb=MAX_RESULT_CACHE_SIZE_MB,
+    hovmoller_band=None,
+    profile_file=None,
+    profile_memory=False,
+    target_grid=None,
+    reductions_store=None,
+    compute_dtype="float32",
+    reduction_engine="groupby",
+    season_years=False,
 ):
     """
     Run the program for producing precipitation plots.
 
     Parameters
     ----------
-    precipitation_netcdf_file : str
-        netCDF filename to read precipitation data from
-    season : optional str
-        Climatological season (one of DJF, MAM, JJA, SON)
+    precipitation_netcdf_file : str or list(str)
+        netCDF filename or Zarr store, glob pattern, or list of these to read
+        precipitation data from. See open_precipitation_data for how multiple
+        inputs are combined.
+    season : optional str or list(str)
+        Climatological season (one of DJF, MAM, JJA, SON), or a list of seasons to
+        plot as panels of one figure, e.g. ["DJF", "MAM", "JJA", "SON"]
     output_file : optional str
         filename to save main image to
     plot_gridlines : optional bool
@@ -277,74 +1356,317 @@ def main(
     countries : optional dict(str: str)
         dictionary mapping country names to regionmask codes. For a list see:
         regionmask.defined_regions.natural_earth_v5_0_0.countries_110.regions
+    chunks : optional dict(str: int) or str
+        Chunk sizes for each dimension, e.g. {"time": 12}, or "auto". If set, the
+        data is loaded lazily with dask and each reduction streams through it chunk
+        by chunk. If None (default) the data is read into memory as normal.
+    ensemble_dim : optional str
+        If set, treat each entry of `precipitation_netcdf_file` as an ensemble member
+        and analyse the ensemble mean.
+    cache_directory : optional str
+        directory to cache products such as country weights in between runs.
+        Defaults to climatology_cache.DEFAULT_CACHE_DIRECTORY.
+    render_workers : optional int
+        number of processes to render the figures with concurrently. If None
+        (default) figures are rendered one after another.
+    natural_earth_directory : optional str
+        local directory of Natural Earth data to use instead of downloading it,
+        for running without network access. See
+        climatology_cache.use_local_natural_earth.
+    diagnostics : optional iterable(str)
+        diagnostics to produce (any of "zonal", "enso", "countries" and
+        "seasonal_map"). The reductions and figures of the other diagnostics are
+        skipped entirely. If None (default) all diagnostics are produced.
+    country_output_files : optional list(str)
+        files to save the country annual averages to, in the formats given by their
+        extensions (".csv", ".parquet", ".nc", ".zarr" or ".txt"). If None (default)
+        only the text report "annual_average_precipitation_by_country.txt" is
+        written.
+    incremental_state_file : optional str
+        If set, run incrementally: running sums of the reductions are kept in this
+        netCDF file, and only time steps later than those already processed are
+        read from the input. See update_precipitation_reductions.
+    result_cache_size_mb : optional float
+        disk budget of the cache of reductions, which lets runs on unchanged input
+        files that only change the figures skip the data pass. 0 disables the cache.
+        See get_precipitation_reductions.
+    hovmoller_band : optional dict(str: tuple(float, float))
+        "lat" and "lon" ranges of the band to draw the Hovmöller diagram of, e.g.
+        {"lat": (-5, 5), "lon": (190, 240)}. Defaults to EQUATORIAL_BAND.
+    profile_file : optional str
+        JSON file to write a machine-readable profile of the run to, with the wall
+        time of each stage and nested step (e.g. "reductions/open", each figure).
+        See run_profile.RunProfile.
+    profile_memory : optional bool
+        Select whether to also record the peak traced memory and peak RSS of each
+        stage in the profile. This slows the run down.
+    target_grid : optional dict
+        If set, regrid the data onto a common grid before any diagnostics, e.g.
+        {"grid_spacing": 2.0, "method": "conservative"}, so the products of
+        different models can be compared and stacked. See
+        regrid_precipitation_data.
+    reductions_store : optional str
+        If set, save the reductions this run calculates (e.g. the annual and
+        seasonal means) to this Zarr store, chunked for reading time series and
+        maps respectively. See save_reductions_to_zarr.
+    compute_dtype : optional str
+        floating point type to reduce the data in, "float32" (default) to keep the
+        full-resolution data in single precision with half the memory, or
+        "float64". Sums are accumulated in double precision either way. See
+        calculate_precipitation_reductions.
+    reduction_engine : optional str
+        how to calculate the annual and seasonal means, "groupby" (default) to
+        average the time steps of each year and season separately, or "monthly" to
+        derive both, weighted by days in month, from monthly means calculated in
+        one pass. Incremental runs always use running sums of the time steps. See
+        calculate_precipitation_reductions.
+    season_years : optional bool
+        If True, map the seasonal climatology over complete, consecutive seasons,
+        with each DJF season running from December into the following year,
+        instead of grouping every December with the January and February of its
+        own year. The mean of each season of each season year is also saved to
+        `reductions_store`, if set. Not used by incremental runs.
 
     Returns
     -------
-    None
+    run_summary : dict
+        the diagnostics run and skipped, and the wall time in seconds taken by each
+        top-level stage of the run ("stage_seconds") and in total ("total_seconds")
 
     """
     if countries is None:
         countries = {"United Kingdom": "GB"}
+    if country_output_files is None:
+        country_output_files = ["annual_average_precipitation_by_country.txt"]
+    if diagnostics is None:
+        diagnostics = list(DIAGNOSTIC_REDUCTIONS)
+    unknown_diagnostics = set(diagnostics) - set(DIAGNOSTIC_REDUCTIONS)
+    if unknown_diagnostics:
+        raise ValueError(
+            f"Unknown diagnostics {sorted(unknown_diagnostics)}, "
+            f"expected any of {list(DIAGNOSTIC_REDUCTIONS)}"
+        )
 
-    precipitation_data = xr.open_dataset(precipitation_netcdf_file)
+    with profile_run(trace_memory=profile_memory) as profile:
+        if natural_earth_directory is not None:
+            use_local_natural_earth(natural_earth_directory)
 
-    plot_zonally_averaged_precipitation(precipitation_data)
-    plot_enso_hovmoller_diagram(precipitation_data)
-    get_country_annual_average(precipitation_data, countries)
+        with profile_stage("reductions"):
+            if incremental_state_file is not None:
+                with profile_stage("open"):
+                    precipitation_data = open_precipitation_data(
+                        precipitation_netcdf_file,
+                        chunks=chunks,
+                        ensemble_dim=ensemble_dim,
+                    )
+                # The state always tracks every reduction, so it stays complete for
+                # later runs whichever diagnostics this run produces.
+                precipitation_reductions = update_precipitation_reductions(
+                    precipitation_data,
+                    incremental_state_file,
+                    equatorial_band=hovmoller_band,
+                    compute_dtype=compute_dtype,
+                    target_grid=target_grid,
+                    cache_directory=cache_directory,
+                )
+            else:
+                precipitation_reductions = get_precipitation_reductions(
+                    precipitation_netcdf_file,
+                    reductions=[
+                        DIAGNOSTIC_REDUCTIONS[diagnostic] for diagnostic in diagnostics
+                    ]
+                    # No diagnostic plots the seasons of each year, so only save them.
+                    + (
+                        ["seasonal_series"]
+                        if season_years and reductions_store is not None
+                        else []
+                    ),
+                    chunks=chunks,
+                    ensemble_dim=ensemble_dim,
+                    equatorial_band=hovmoller_band,
+                    target_grid=target_grid,
+                    compute_dtype=compute_dtype,
+                    reduction_engine=reduction_engine,
+                    season_years=season_years,
+                    cache_directory=cache_directory,
+                    max_cache_size_mb=result_cache_size_mb,
+                )
 
-    seasonal_average_precipitation = (
-        precipitation_data["pr"].groupby("time.season").mean("time", keep_attrs=True)
-    )
+        if reductions_store is not None:
+            with profile_stage("save_reductions"):
+                save_reductions_to_zarr(precipitation_reductions, reductions_store)
 
-    try:
-        input_units = seasonal_average_precipitation.attrs["units"]
-    except KeyError as exc:
-        raise KeyError(
-            "Precipitation variable in {pr_file} must have a units attribute"
-        ) from exc
+        if "countries" in diagnostics:
+            with profile_stage("countries"):
+                get_country_annual_average(
+                    precipitation_reductions["annual"],
+                    countries,
+                    cache_directory=cache_directory,
+                    output_files=country_output_files,
+                )
 
-    if input_units == "kg m-2 s-1":
-        seasonal_average_precipitation = convert_precipitation_units(
-            seasonal_average_precipitation
+        figure_tasks = create_figure_tasks(
+            precipitation_reductions,
+            diagnostics,
+            model_name=precipitation_reductions.attrs["source_id"],
+            season=season,
+            output_file=output_file,
+            mask=mask,
+            plot_gridlines=plot_gridlines,
+            cbar_levels=cbar_levels,
+            cache_directory=cache_directory,
         )
-    elif input_units == "mm/day":
-        pass
-    else:
-        raise ValueError("""Input units are not 'kg m-2 s-1' or 'mm/day'""")
-
-    create_precipitation_climatology_plot(
-        seasonal_average_precipitation,
-        precipitation_data.attrs["source_id"],
-        season,
-        mask=mask,
-        plot_gridlines=plot_gridlines,
-        levels=cbar_levels,
-    )
+        if figure_tasks:
+            # Already loaded by create_figure_tasks, so importing again is cheap.
+            import climatology_plots  # noqa: PLC0415
 
-    plt.savefig(output_file, dpi=200)
+            with profile_stage("render"):
+                climatology_plots.render_figures(
+                    figure_tasks, render_workers=render_workers
+                )
 
+    run_summary = {
+        "diagnostics": list(diagnostics),
+        "skipped_diagnostics": [
+            diagnostic
+            for diagnostic in DIAGNOSTIC_REDUCTIONS
+            if diagnostic not in diagnostics
+        ],
+        "stage_seconds": profile.get_stage_seconds(),
+        "total_seconds": profile.total_seconds,
+    }
+    if profile_file is not None:
+        profile.write(
+            profile_file,
+            input_files=precipitation_netcdf_file,
+            diagnostics=run_summary["diagnostics"],
+            render_workers=render_workers,
+            chunks=chunks,
+        )
 
-if __name__ == "__main__":
-    # Get config from command line
-    config_name = input("Enter configuration name: ")
-    if config_name == "":
-        print("Using default configuration in 'default_config.json'.")
-        config_name = "default_config"
-    else:
-        print(f"Using configuration in '{config_name}.json'.")
-    config_file = config_name + ".json"
-    with open(config_file, encoding="utf-8") as json_file:
-        config = json.load(json_file)
+    return run_summary
+
+
+def run_configuration(config, output_file="output.png", diagnostics=None):
+    """
+    Run the program using settings from a configuration dictionary.
+
+    Parameters
+    ----------
+    config : dict
+        configuration settings as read from a JSON configuration file.
+        See 'default_config.json' for the available keys.
+    output_file : optional str
+        filename to save main image to
+    diagnostics : optional iterable(str)
+        diagnostics to produce, overriding the "diagnostics" configuration setting.
+        See main.
+
+    Returns
+    -------
+    run_summary : dict
+        timings of the run. See main.
 
-    output_filename = f"{config_name}_output.png"
-    gridlines_on = True
-    colorbar_levels = None
+    """
+    if diagnostics is None:
+        diagnostics = config.get("diagnostics")
 
-    main(
+    return main(
         config["input_file"],
         season=config["season_to_plot"],
-        output_file=output_filename,
+        output_file=output_file,
         mask=config["mask_id"],
         plot_gridlines=config["gridlines_on"],
         countries=config["countries_to_record"],
+        chunks=config.get("chunks"),
+        ensemble_dim=config.get("ensemble_dim"),
+        cache_directory=config.get("cache_directory"),
+        render_workers=config.get("render_workers"),
+        natural_earth_directory=config.get("natural_earth_directory"),
+        diagnostics=diagnostics,
+        country_output_files=config.get("country_output_files"),
+        incremental_state_file=config.get("incremental_state_file"),
+        result_cache_size_mb=config.get(
+            "result_cache_size_mb", MAX_RESULT_CACHE_SIZE_MB
+        ),
+        hovmoller_band=config.get("hovmoller_band"),
+        profile_file=config.get("profile_file"),
+        profile_memory=config.get("profile_memory", False),
+        target_grid=config.get("target_grid"),
+        reductions_store=config.get("reductions_store"),
+        compute_dtype=config.get("compute_dtype", "float32"),
+        reduction_engine=config.get("reduction_engine", "groupby"),
+        season_years=config.get("season_years", False),
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Produce precipitation climatology diagnostics from ESM output."
+    )
+    parser.add_argument(
+        "config_file",
+        nargs="?",
+        default="default_config.json",
+        help="JSON configuration file (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--output",
+        help="filename to save the seasonal map to (default: <config>_output.png)",
+    )
+    diagnostic_selection = parser.add_mutually_exclusive_group()
+    diagnostic_selection.add_argument(
+        "--only",
+        nargs="+",
+        choices=list(DIAGNOSTIC_REDUCTIONS),
+        metavar="DIAGNOSTIC",
+        help=f"only produce these diagnostics (from {', '.join(DIAGNOSTIC_REDUCTIONS)})",
     )
+    diagnostic_selection.add_argument(
+        "--skip",
+        nargs="+",
+        choices=list(DIAGNOSTIC_REDUCTIONS),
+        metavar="DIAGNOSTIC",
+        help="produce all diagnostics except these",
+    )
+    parser.add_argument(
+        "--summary",
+        help="JSON file to record the run timings in, e.g. of a run of all "
+        "diagnostics to use as a later --baseline (default: not recorded)",
+    )
+    parser.add_argument(
+        "--baseline",
+        help="run timings recorded with --summary, e.g. for a run of all "
+        "diagnostics, to report the time saved by skipping diagnostics against",
+    )
+    args = parser.parse_args()
+
+    print(f"Using configuration in '{args.config_file}'.")
+    with open(args.config_file, encoding="utf-8") as json_file:
+        config = json.load(json_file)
+
+    output_filename = args.output or f"{Path(args.config_file).stem}_output.png"
+
+    selected_diagnostics = None
+    if args.only is not None:
+        selected_diagnostics = args.only
+    elif args.skip is not None:
+        selected_diagnostics = [
+            diagnostic
+            for diagnostic in config.get("diagnostics") or DIAGNOSTIC_REDUCTIONS
+            if diagnostic not in args.skip
+        ]
+
+    run_summary = run_configuration(
+        config, output_file=output_filename, diagnostics=selected_diagnostics
+    )
+
+    baseline_run_summary = None
+    if args.baseline is not None:
+        with open(args.baseline, encoding="utf-8") as json_file:
+            baseline_run_summary = json.load(json_file)
+    print(format_run_summary(run_summary, baseline_run_summary))
+
+    if args.summary is not None:
+        with open(args.summary, "w", encoding="utf-8") as json_file:
+            json.dump(run_summary, json_file, indent=2)
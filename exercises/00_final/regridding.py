@@ -0,0 +1,339 @@
+"""Regridding of gridded data onto a common latitude-longitude grid."""
+
+import numpy as np
+import scipy.sparse
+import xarray as xr
+from climatology_cache import get_cached_result, hash_grid
+from grid_weights import (
+    apply_region_weights,
+    calculate_cell_bounds,
+    sparse_weights_from_dataset,
+    sparse_weights_to_dataset,
+)
+
+REGRIDDING_METHODS = ("conservative", "bilinear")
+MAX_REGRIDDING_CACHE_SIZE_MB = 200
+
+
+def create_regular_grid(grid_spacing):
+    """
+    Create the coordinates of a global regular latitude-longitude grid.
+
+    Parameters
+    ----------
+    grid_spacing : float
+        spacing of the grid in degrees. It should divide 180 exactly.
+
+    Returns
+    -------
+    latitude : xarray.DataArray
+        latitudes of the cell centres, from south to north
+    longitude : xarray.DataArray
+        longitudes of the cell centres, eastwards from 0
+
+    """
+    latitude = np.arange(-90 + grid_spacing / 2, 90, grid_spacing)
+    longitude = np.arange(grid_spacing / 2, 360, grid_spacing)
+    return (
+        xr.DataArray(latitude, dims="lat", attrs={"units": "degrees_north"}),
+        xr.DataArray(longitude, dims="lon", attrs={"units": "degrees_east"}),
+    )
+
+
+def calculate_overlap_weights(source_bounds, target_bounds, period=None):
+    """
+    Calculate the fraction of each target interval covered by each source interval.
+
+    Parameters
+    ----------
+    source_bounds : numpy.ndarray
+        edges of the source intervals, one longer than the number of intervals
+    target_bounds : numpy.ndarray
+        edges of the target intervals, one longer than the number of intervals
+    period : optional float
+        period of the coordinate (e.g. 360 for longitude), so that intervals
+        overlapping across the periodic boundary are included
+
+    Returns
+    -------
+    overlap_weights : scipy.sparse.csr_array
+        matrix with one row per target interval and one column per source interval
+
+    """
+    source_lower = np.minimum(source_bounds[:-1], source_bounds[1:])
+    source_upper = np.maximum(source_bounds[:-1], source_bounds[1:])
+    target_lower = np.minimum(target_bounds[:-1], target_bounds[1:])[:, np.newaxis]
+    target_upper = np.maximum(target_bounds[:-1], target_bounds[1:])[:, np.newaxis]
+
+    shifts = [0.0] if period is None else [-period, 0.0, period]
+    overlaps = sum(
+        np.clip(
+            np.minimum(target_upper, source_upper + shift)
+            - np.maximum(target_lower, source_lower + shift),
+            0.0,
+            None,
+        )
+        for shift in shifts
+    )
+
+    return scipy.sparse.csr_array(overlaps / (target_upper - target_lower))
+
+
+def calculate_linear_weights(source_points, target_points, period=None):
+    """
+    Calculate weights to linearly interpolate from source points to target points.
+
+    Target points outside the range of the source points take the value of the
+    nearest source point, unless the coordinate is periodic.
+
+    Parameters
+    ----------
+    source_points : numpy.ndarray
+        coordinate values of the source points
+    target_points : numpy.ndarray
+        coordinate values of the target points
+    period : optional float
+        period of the coordinate (e.g. 360 for longitude), so that points are
+        interpolated across the periodic boundary
+
+    Returns
+    -------
+    linear_weights : scipy.sparse.csr_array
+        matrix with one row per target point and one column per source point
+
+    """
+    if period is not None:
+        source_points = source_points % period
+        target_points = target_points % period
+    source_order = np.argsort(source_points)
+    sorted_points = source_points[source_order]
+    if period is not None:
+        # Wrap the first and last points around, to bracket points between them.
+        sorted_points = np.concatenate(
+            [[sorted_points[-1] - period], sorted_points, [sorted_points[0] + period]]
+        )
+        source_order = np.concatenate(
+            [[source_order[-1]], source_order, [source_order[0]]]
+        )
+
+    target_points = np.clip(target_points, sorted_points[0], sorted_points[-1])
+    upper_positions = np.clip(
+        np.searchsorted(sorted_points, target_points, side="right"),
+        1,
+        sorted_points.size - 1,
+    )
+    lower_positions = upper_positions - 1
+    upper_fractions = (target_points - sorted_points[lower_positions]) / (
+        sorted_points[upper_positions] - sorted_points[lower_positions]
+    )
+
+    target_indices = np.arange(target_points.size)
+    # Duplicate entries (e.g. a target point on a source point) are summed.
+    return scipy.sparse.coo_array(
+        (
+            np.concatenate([1 - upper_fractions, upper_fractions]),
+            (
+                np.concatenate([target_indices, target_indices]),
+                np.concatenate(
+                    [source_order[lower_positions], source_order[upper_positions]]
+                ),
+            ),
+        ),
+        shape=(target_points.size, source_points.size),
+    ).tocsr()
+
+
+def calculate_regridding_weights(
+    source_latitude, source_longitude, target_latitude, target_longitude, method
+):
+    """
+    Calculate a sparse matrix of weights regridding between two rectilinear grids.
+
+    Both methods are separable on rectilinear grids, so the weights are built as
+    the Kronecker product of one-dimensional latitude and longitude weights.
+    Conservative weights are the fraction of each target cell's area covered by
+    each source cell, with area proportional to the difference in the sines of
+    the cell's latitude edges. Bilinear weights interpolate between the four
+    source cell centres surrounding each target cell centre.
+
+    Parameters
+    ----------
+    source_latitude : xarray.DataArray
+        latitude coordinate of the source grid
+    source_longitude : xarray.DataArray
+        longitude coordinate of the source grid
+    target_latitude : xarray.DataArray
+        latitude coordinate of the target grid
+    target_longitude : xarray.DataArray
+        longitude coordinate of the target grid
+    method : str
+        regridding method (one of "conservative" or "bilinear")
+
+    Returns
+    -------
+    regridding_weights : scipy.sparse.csr_array
+        weights with one row per target cell and one column per source cell, with
+        cells ordered as in flattened ("lat", "lon") arrays
+
+    """
+    if method == "conservative":
+        latitude_weights = calculate_overlap_weights(
+            *(
+                np.sin(np.deg2rad(np.clip(calculate_cell_bounds(values), -90, 90)))
+                for values in (source_latitude.values, target_latitude.values)
+            )
+        )
+        longitude_weights = calculate_overlap_weights(
+            calculate_cell_bounds(source_longitude.values),
+            calculate_cell_bounds(target_longitude.values),
+            period=360,
+        )
+    elif method == "bilinear":
+        latitude_weights = calculate_linear_weights(
+            source_latitude.values, target_latitude.values
+        )
+        longitude_weights = calculate_linear_weights(
+            source_longitude.values, target_longitude.values, period=360
+        )
+    else:
+        raise ValueError(
+            f"Regridding method must be one of {REGRIDDING_METHODS}, not '{method}'"
+        )
+
+    return scipy.sparse.kron(latitude_weights, longitude_weights, format="csr")
+
+
+def get_regridding_weights(
+    source_latitude,
+    source_longitude,
+    target_latitude,
+    target_longitude,
+    *,
+    method="conservative",
+    cache_directory=None,
+    max_cache_size_mb=MAX_REGRIDDING_CACHE_SIZE_MB,
+):
+    """
+    Get the regridding weights between two grids, calculating them only if not cached.
+
+    Weights are stored on disk keyed by the method and both grids, so they are
+    calculated once for each pair of source and target grids.
+
+    Parameters
+    ----------
+    source_latitude : xarray.DataArray
+        latitude coordinate of the source grid
+    source_longitude : xarray.DataArray
+        longitude coordinate of the source grid
+    target_latitude : xarray.DataArray
+        latitude coordinate of the target grid
+    target_longitude : xarray.DataArray
+        longitude coordinate of the target grid
+    method : optional str
+        regridding method (one of "conservative" or "bilinear")
+    cache_directory : optional str or pathlib.Path
+        directory to store cached weights in. Defaults to DEFAULT_CACHE_DIRECTORY.
+    max_cache_size_mb : optional float
+        maximum total size of cached weights. The least recently used weights are
+        removed once this is exceeded.
+
+    Returns
+    -------
+    regridding_weights : scipy.sparse.csr_array
+        weights with one row per target cell and one column per source cell. See
+        calculate_regridding_weights.
+
+    """
+
+    def calculate_weights_dataset():
+        return sparse_weights_to_dataset(
+            calculate_regridding_weights(
+                source_latitude,
+                source_longitude,
+                target_latitude,
+                target_longitude,
+                method,
+            )
+        )
+
+    return sparse_weights_from_dataset(
+        get_cached_result(
+            f"{method}_{hash_grid(source_latitude, source_longitude)}"
+            f"_{hash_grid(target_latitude, target_longitude)}",
+            calculate_weights_dataset,
+            cache_directory=cache_directory,
+            max_cache_size_mb=max_cache_size_mb,
+            subdirectory="regridding_weights",
+        )
+    )
+
+
+def regrid(
+    data,
+    target_latitude,
+    target_longitude,
+    method="conservative",
+    cache_directory=None,
+):
+    """
+    Regrid data onto a target latitude-longitude grid.
+
+    Every time step is regridded by the same sparse matrix product. Missing source
+    cells are left out and the remaining weights of each target cell renormalised,
+    so target cells with no valid source cells are NaN. Dask-backed data is
+    regridded lazily, chunk by chunk.
+
+    Parameters
+    ----------
+    data : xarray.DataArray
+        data with "lat" and "lon" dimensions
+    target_latitude : xarray.DataArray
+        latitude coordinate of the target grid
+    target_longitude : xarray.DataArray
+        longitude coordinate of the target grid
+    method : optional str
+        regridding method (one of "conservative" or "bilinear"). See
+        calculate_regridding_weights.
+    cache_directory : optional str or pathlib.Path
+        directory to cache the weights in between runs. See
+        get_regridding_weights.
+
+    Returns
+    -------
+    regridded_data : xarray.DataArray
+        data on the target grid, with the attributes of `data`
+
+    """
+    regridding_weights = get_regridding_weights(
+        data.lat,
+        data.lon,
+        target_latitude,
+        target_longitude,
+        method=method,
+        cache_directory=cache_directory,
+    )
+    target_shape = (target_latitude.size, target_longitude.size)
+    regridded_dtype = np.result_type(data.dtype, np.float32)
+
+    def regrid_values(values):
+        return apply_region_weights(
+            regridding_weights, values, dtype=regridded_dtype
+        ).reshape(*values.shape[:-2], *target_shape)
+
+    regridded_data = xr.apply_ufunc(
+        regrid_values,
+        data,
+        input_core_dims=[["lat", "lon"]],
+        output_core_dims=[["lat", "lon"]],
+        exclude_dims={"lat", "lon"},
+        dask="parallelized",
+        dask_gufunc_kwargs={
+            "output_sizes": dict(zip(("lat", "lon"), target_shape, strict=True))
+        },
+        output_dtypes=[regridded_dtype],
+        keep_attrs=True,
+    )
+
+    return regridded_data.assign_coords(
+        lat=target_latitude.values, lon=target_longitude.values
+    )
@@ -0,0 +1,41 @@
+"""Pools of worker processes for rendering figures without a display.
+
+This is kept apart from the plotting routines so that starting a pool, e.g. for a
+batch of runs that may draw no figures, does not import the plotting libraries.
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+def initialise_render_worker():
+    """Set up a worker process to render figures without a display."""
+    # matplotlib reads the backend when it is first imported, so workers that draw
+    # no figures never load it.
+    os.environ["MPLBACKEND"] = "Agg"
+
+
+def create_render_pool(max_workers):
+    """
+    Create a pool of worker processes that render figures without a display.
+
+    The workers are fresh "spawn" processes, so no pyplot or dask state is inherited
+    from this process.
+
+    Parameters
+    ----------
+    max_workers : int
+        number of worker processes
+
+    Returns
+    -------
+    render_pool : concurrent.futures.ProcessPoolExecutor
+        the pool of worker processes, to use as a context manager
+
+    """
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=initialise_render_worker,
+    )
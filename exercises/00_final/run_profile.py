@@ -0,0 +1,287 @@
+"""Timing and memory instrumentation of the stages of a run."""
+
+import contextlib
+import datetime as dt
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where peak RSS is not recorded.
+    resource = None
+
+_active_profiles = []
+
+
+def get_max_rss_bytes():
+    """
+    Get the peak resident set size (RSS) of this process so far.
+
+    Returns
+    -------
+    max_rss_bytes : int or None
+        peak RSS in bytes, or None where it cannot be measured
+
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS but in kilobytes elsewhere.
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+class RunProfile:
+    """
+    Record of the wall time and, optionally, memory use of the stages of a run.
+
+    Stages are timed with the `stage` context manager and may be nested, in which
+    case their names are joined with "/", e.g. "reductions/open". With
+    `trace_memory`, the peak memory allocated through Python (from tracemalloc)
+    during each stage and the peak RSS of the process at its end are recorded too.
+    """
+
+    def __init__(self, trace_memory=False):
+        """
+        Start a run profile.
+
+        Parameters
+        ----------
+        trace_memory : optional bool
+            Select whether to record the memory use of each stage. Tracing memory
+            allocations slows down the run, so this is off by default.
+
+        """
+        self.trace_memory = trace_memory
+        self.stages = []
+        self.started_at = dt.datetime.now(dt.timezone.utc).isoformat()
+        self.start_time = time.perf_counter()
+        self.total_seconds = None
+        self._open_stages = []
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Time a stage of the run, and record its memory use if tracing memory.
+
+        Parameters
+        ----------
+        name : str
+            name of the stage
+
+        Yields
+        ------
+        None
+
+        """
+        parent_stage = self._open_stages[-1] if self._open_stages else None
+        current_stage = {
+            "name": name if parent_stage is None else f"{parent_stage['name']}/{name}",
+            "peak_traced_bytes": 0,
+        }
+        if self.trace_memory:
+            # Keep the peak reached so far by the enclosing stage before resetting.
+            if parent_stage is not None:
+                parent_stage["peak_traced_bytes"] = max(
+                    parent_stage["peak_traced_bytes"],
+                    tracemalloc.get_traced_memory()[1],
+                )
+            tracemalloc.reset_peak()
+
+        self._open_stages.append(current_stage)
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start_time
+            self._open_stages.pop()
+            measurements = {}
+            if self.trace_memory:
+                current_stage["peak_traced_bytes"] = max(
+                    current_stage["peak_traced_bytes"],
+                    tracemalloc.get_traced_memory()[1],
+                )
+                if parent_stage is not None:
+                    parent_stage["peak_traced_bytes"] = max(
+                        parent_stage["peak_traced_bytes"],
+                        current_stage["peak_traced_bytes"],
+                    )
+                measurements = {
+                    "peak_traced_bytes": current_stage["peak_traced_bytes"],
+                    "max_rss_bytes": get_max_rss_bytes(),
+                }
+            self.stages.append(
+                {"name": current_stage["name"], "seconds": seconds, **measurements}
+            )
+
+    def record_stage(self, name, seconds, **measurements):
+        """
+        Record a stage timed elsewhere, e.g. in a worker process.
+
+        Parameters
+        ----------
+        name : str
+            name of the stage, nested under the innermost stage currently open
+        seconds : float
+            wall time taken by the stage
+        **measurements
+            other measurements of the stage, e.g. "max_rss_bytes"
+
+        Returns
+        -------
+        None
+
+        """
+        if self._open_stages:
+            name = f"{self._open_stages[-1]['name']}/{name}"
+        self.stages.append({"name": name, "seconds": seconds, **measurements})
+
+    def finish(self):
+        """Record the total wall time of the run."""
+        self.total_seconds = time.perf_counter() - self.start_time
+
+    def get_stage_seconds(self):
+        """
+        Get the total wall time of each top-level (not nested) stage.
+
+        Returns
+        -------
+        stage_seconds : dict(str: float)
+            wall time of each top-level stage in the order they first ran, summed
+            over repeats of the same stage
+
+        """
+        stage_seconds = {}
+        for stage in self.stages:
+            if "/" not in stage["name"]:
+                stage_seconds[stage["name"]] = (
+                    stage_seconds.get(stage["name"], 0.0) + stage["seconds"]
+                )
+        return stage_seconds
+
+    def to_dict(self, **run_details):
+        """
+        Get the profile as a JSON serialisable dictionary.
+
+        Parameters
+        ----------
+        **run_details
+            JSON serialisable details of the run to include, e.g. its input files
+
+        Returns
+        -------
+        profile : dict
+            the run details, host and Python version, start time, total wall time,
+            peak RSS if tracing memory, and the list of stages in the order they
+            finished
+
+        """
+        profile = {
+            **run_details,
+            "started_at": self.started_at,
+            "host": platform.node(),
+            "python_version": platform.python_version(),
+            "total_seconds": self.total_seconds,
+            "stages": self.stages,
+        }
+        if self.trace_memory:
+            profile["max_rss_bytes"] = get_max_rss_bytes()
+        return profile
+
+    def write(self, profile_file, **run_details):
+        """
+        Write the profile to a JSON file.
+
+        Parameters
+        ----------
+        profile_file : str or pathlib.Path
+            file to write the profile to
+        **run_details
+            JSON serialisable details of the run to include. See to_dict.
+
+        Returns
+        -------
+        None
+
+        """
+        with open(profile_file, "w", encoding="utf-8") as json_file:
+            json.dump(self.to_dict(**run_details), json_file, indent=2)
+
+
+@contextlib.contextmanager
+def profile_run(trace_memory=False):
+    """
+    Profile a run, making its profile the one `profile_stage` records into.
+
+    Parameters
+    ----------
+    trace_memory : optional bool
+        Select whether to record the memory use of each stage. See RunProfile.
+
+    Yields
+    ------
+    profile : RunProfile
+        the profile of the run. Its total time is recorded on leaving the context.
+
+    """
+    profile = RunProfile(trace_memory=trace_memory)
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+
+    _active_profiles.append(profile)
+    try:
+        yield profile
+    finally:
+        _active_profiles.pop()
+        profile.finish()
+        if started_tracing:
+            tracemalloc.stop()
+
+
+@contextlib.contextmanager
+def profile_stage(name):
+    """
+    Time a stage in the active run profile, doing nothing if no run is profiled.
+
+    Parameters
+    ----------
+    name : str
+        name of the stage. See RunProfile.stage.
+
+    Yields
+    ------
+    None
+
+    """
+    if not _active_profiles:
+        yield
+        return
+
+    with _active_profiles[-1].stage(name):
+        yield
+
+
+def record_stage(name, seconds, **measurements):
+    """
+    Record a stage timed elsewhere in the active run profile, if there is one.
+
+    Parameters
+    ----------
+    name : str
+        name of the stage, nested under any stage open in the active profile
+    seconds : float
+        wall time taken by the stage
+    **measurements
+        other measurements of the stage. See RunProfile.record_stage.
+
+    Returns
+    -------
+    None
+
+    """
+    if _active_profiles:
+        _active_profiles[-1].record_stage(name, seconds, **measurements)
@@ -0,0 +1,153 @@
+"""Running sums for updating precipitation climatologies as new time steps arrive."""
+
+from pathlib import Path
+
+import xarray as xr
+from climatology_cache import write_cache_file
+
+RUNNING_SUM_VARIABLES = ("annual", "seasonal")
+TIME_SERIES_VARIABLES = ("zonal", "equatorial")
+
+
+def calculate_running_sums(precipitation):
+    """
+    Calculate the sums and counts from which the annual and seasonal means are built.
+
+    Sums are accumulated in double precision, so that they stay accurate as more
+    and more time steps are added to them.
+
+    Parameters
+    ----------
+    precipitation : xarray.DataArray
+        precipitation with dimensions ("time", "lat", "lon")
+
+    Returns
+    -------
+    running_sums : xarray.Dataset
+        Dataset containing "annual_sum" and "annual_count" with dimensions
+        ("year", "lat", "lon"), and "seasonal_sum" and "seasonal_count" with
+        dimensions ("season", "lat", "lon"). Counts are of the non-missing values.
+
+    """
+    valid_values = precipitation.notnull()
+
+    running_sums = xr.Dataset()
+    for variable, group in zip(
+        RUNNING_SUM_VARIABLES, ("time.year", "time.season"), strict=True
+    ):
+        # Accumulate in double precision without a double precision copy of the data.
+        running_sums[f"{variable}_sum"] = precipitation.groupby(group).sum(
+            "time", dtype="float64", keep_attrs=True
+        )
+        running_sums[f"{variable}_count"] = valid_values.groupby(group).sum("time")
+
+    return running_sums
+
+
+def update_running_state(running_state, new_running_state):
+    """
+    Add the running sums and time series of new time steps to a running state.
+
+    Parameters
+    ----------
+    running_state : xarray.Dataset or None
+        running state of the time steps processed so far, or None if there are none
+    new_running_state : xarray.Dataset
+        running state of the new time steps only, which must all be later than those
+        of `running_state`
+
+    Returns
+    -------
+    updated_running_state : xarray.Dataset
+        running state covering the time steps of both states. Years and seasons
+        present in both have their sums and counts added.
+
+    """
+    if running_state is None:
+        return new_running_state
+
+    updated_running_state = xr.Dataset(attrs=running_state.attrs)
+    for variable in TIME_SERIES_VARIABLES:
+        updated_running_state[variable] = xr.concat(
+            [running_state[variable], new_running_state[variable]], dim="time"
+        )
+
+    running_sum_names = [
+        f"{variable}_{statistic}"
+        for variable in RUNNING_SUM_VARIABLES
+        for statistic in ("sum", "count")
+    ]
+    # Years or seasons missing from one state are filled with NaN and skipped.
+    combined_sums = xr.concat(
+        [running_state[running_sum_names], new_running_state[running_sum_names]],
+        dim="update",
+        join="outer",
+    ).sum("update", keep_attrs=True)
+
+    return updated_running_state.merge(combined_sums)
+
+
+def calculate_running_means(running_state):
+    """
+    Calculate the annual and seasonal means from their running sums and counts.
+
+    Parameters
+    ----------
+    running_state : xarray.Dataset
+        running state as built by update_running_state
+
+    Returns
+    -------
+    running_means : dict(str: xarray.DataArray)
+        "annual" mean with dimensions ("year", "lat", "lon") and "seasonal" mean
+        with dimensions ("season", "lat", "lon"). Cells with no valid values are NaN.
+
+    """
+    running_means = {}
+    for variable in RUNNING_SUM_VARIABLES:
+        running_sum = running_state[f"{variable}_sum"]
+        running_count = running_state[f"{variable}_count"]
+        running_means[variable] = (
+            running_sum / running_count.where(running_count > 0)
+        ).assign_attrs(running_sum.attrs)
+
+    return running_means
+
+
+def load_running_state(state_file):
+    """
+    Load a running state saved by save_running_state.
+
+    Parameters
+    ----------
+    state_file : str or pathlib.Path
+        netCDF file the running state was saved to
+
+    Returns
+    -------
+    running_state : xarray.Dataset or None
+        the saved running state, or None if no state has been saved yet
+
+    """
+    if not Path(state_file).exists():
+        return None
+    return xr.load_dataset(state_file)
+
+
+def save_running_state(running_state, state_file):
+    """
+    Save a running state to a netCDF file, replacing any previous state atomically.
+
+    Parameters
+    ----------
+    running_state : xarray.Dataset
+        running state to save
+    state_file : str or pathlib.Path
+        netCDF file to save the running state to
+
+    Returns
+    -------
+    None
+
+    """
+    write_cache_file(running_state, Path(state_file))